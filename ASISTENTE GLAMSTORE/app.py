@@ -3,17 +3,17 @@ from dotenv import load_dotenv
 load_dotenv()
 import logging
 import time
-import requests
-import threading
+from services.http_client import http_client
 from datetime import datetime
 from flask import Flask, request, jsonify
-from collections import deque
+from collections import deque, Counter
 from database import db 
 from typing import List, Dict, Any, Optional
 
 # --- SERVICIOS (Arquitectura Elite) ---
 from services.whatsapp_service import enviar_whatsapp, descargar_media_meta, check_rate_limit, enviar_reporte_email
 from services.ai_service import procesar_inteligencia_artificial
+from services.worker_pool import BoundedWorkerPool, KeyedDispatcher, LimitadorPorClave
 
 # Configuración de Logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,6 +29,73 @@ VERIFY_TOKEN = os.environ.get("META_VERIFY_TOKEN", "glamstore_verify_token")
 # processed_message_ids = deque(maxlen=100) # Deprecated by DB
 MEMORIA_USUARIOS = {}
 
+# --- POOL DE PROCESAMIENTO (IA + WhatsApp) ---
+# Hilos fijos + cola acotada: ante una ráfaga se responde "ocupados" en vez de crear hilos sin límite
+POOL_WEBHOOK = BoundedWorkerPool(
+    workers=int(os.environ.get("WEBHOOK_WORKERS", 4)),
+    max_cola=int(os.environ.get("WEBHOOK_MAX_COLA", 32)),
+    nombre="webhook"
+)
+MENSAJE_OCUPADO = "🙏 ¡Hola! En este momento estamos atendiendo a muchas personas. Escríbenos de nuevo en unos minutos, por favor. 💖"
+
+# El aviso de "ocupados" sale por un pool chico aparte: el webhook no espera a Graph API justo bajo carga.
+# Uno por número por ventana (un cliente insistente no recibe N avisos ni multiplica las llamadas salientes).
+POOL_AVISOS = BoundedWorkerPool(
+    workers=int(os.environ.get("AVISOS_WORKERS", 2)),
+    max_cola=int(os.environ.get("AVISOS_MAX_COLA", 64)),
+    nombre="avisos"
+)
+LIMITE_AVISO_OCUPADO = LimitadorPorClave(ventana=float(os.environ.get("AVISO_OCUPADO_VENTANA", 60)))
+
+
+def avisar_ocupado(numero: str) -> None:
+    """Encola el aviso de ocupado sin bloquear (si no se avisó a este número hace poco)."""
+    if not LIMITE_AVISO_OCUPADO.permitir(numero):
+        return
+    if not POOL_AVISOS.enviar(enviar_whatsapp, numero, MENSAJE_OCUPADO):
+        logging.warning(f"🚦 Cola de avisos llena: {numero} queda sin aviso de ocupado")
+
+
+def atender_mensaje(numero: str, m: Dict[str, Any]) -> None:
+    """
+    Procesa un mensaje del carril de `numero`. El historial se arma aquí (ya incluye la respuesta anterior).
+    La media se descarga aquí, en el worker: el hilo del webhook solo encola el ID y responde a Meta.
+    """
+    imagen_bytes = descargar_media_meta(m["imagen_id"]) if m["imagen_id"] else None
+    audio_bytes = None
+    if m["audio_id"]:
+        logging.info(f"🎤 Audio recibido ID: {m['audio_id']}. Descargando...")
+        audio_bytes = descargar_media_meta(m["audio_id"])
+
+    usuario = MEMORIA_USUARIOS.setdefault(numero, {'historial': deque(maxlen=6), 'msg_map': {}})
+    historial_txt = "\n".join([f"U: {h['txt']}\nB: {h['resp']}" for h in usuario['historial']])
+    procesar_inteligencia_artificial(
+        numero, m["nombre"], m["texto"], historial_txt, usuario, m["msg_context_id"], imagen_bytes, audio_bytes
+    )
+
+
+def combinar_mensajes(mensajes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ráfaga del mismo cliente: textos seguidos -> un solo mensaje (una llamada al LLM). Fotos/audios van aparte."""
+    resultado: List[Dict[str, Any]] = []
+    for m in mensajes:
+        previo = resultado[-1] if resultado else None
+        solo_texto = not m["imagen_id"] and not m["audio_id"]
+        if previo is not None and solo_texto and not previo["imagen_id"] and not previo["audio_id"]:
+            resultado[-1] = dict(previo, texto=f"{previo['texto']}\n{m['texto']}",
+                                 msg_context_id=m["msg_context_id"] or previo["msg_context_id"])
+        else:
+            resultado.append(m)
+    return resultado
+
+
+# Carriles por número: en orden por cliente, en paralelo entre clientes
+DESPACHADOR_WEBHOOK = KeyedDispatcher(
+    POOL_WEBHOOK,
+    atender_mensaje,
+    combinar=combinar_mensajes if os.environ.get("WEBHOOK_COMBINAR", "false").lower() == "true" else None,
+    ventana=float(os.environ.get("WEBHOOK_VENTANA_COMBINAR", 1.5))
+)
+
 # --- RUTAS DE MANTENIMIENTO ---
 @app.route("/")
 def home():
@@ -37,17 +104,26 @@ def home():
 @app.route("/debug/force_sync")
 def debug_force_sync():
     try:
-        db._actualizar_tabla_maestra() 
+        db.solicitar_sync(completa=request.args.get("modo") != "incremental", esperar=True)
         return jsonify(db.get_status())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/debug/cola")
+def debug_cola():
+    """Profundidad de la cola del webhook y tiempos de espera."""
+    return jsonify({
+        **POOL_WEBHOOK.stats(), **DESPACHADOR_WEBHOOK.stats(), "estados_entrega": dict(ESTADOS_ENTREGA),
+        "avisos": {**POOL_AVISOS.stats(), "suprimidos": LIMITE_AVISO_OCUPADO.suprimidos}
+    }), 200
+
 @app.route("/debug/search")
 def debug_search():
     query = request.args.get("q", "")
     if not query: return "Falta 'q'", 400
-    resultado = db.buscar_contextual(query)
-    return jsonify({"q": query, "res": resultado}), 200
+    engine = request.args.get("engine") # "memoria" | "fts" (opcional)
+    resultado = db.buscar_contextual(query, engine=engine)
+    return jsonify({"q": query, "res": resultado, "cache": db.cache_stats()}), 200
 
 @app.route("/admin/db")
 def admin_db():
@@ -146,8 +222,7 @@ def admin_db():
 
 @app.route("/admin/force_sync")
 def admin_force_sync():
-    import threading
-    threading.Thread(target=db._actualizar_tabla_maestra).start()
+    db.solicitar_sync(completa=True)
     return "Sincronización iniciada en segundo plano. <a href='/admin/db'>Volver</a>"
 
 @app.route("/debug/shopify")
@@ -184,7 +259,7 @@ def debug_shopify():
         }
         """
         
-        response = requests.post(f"https://{db.shopify_url}/admin/api/2023-01/graphql.json", json={"query": query}, headers=headers)
+        response = http_client.post(f"https://{db.shopify_url}/admin/api/2023-01/graphql.json", json={"query": query}, headers=headers)
         
         return jsonify({
             "status_code": response.status_code,
@@ -195,69 +270,55 @@ def debug_shopify():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# --- WEBHOOK PRINCIPAL ---
-@app.route("/webhook", methods=["GET", "POST"])
-def webhook():
-    # 1. VERIFICACIÓN (GET)
-    if request.method == "GET":
-        if request.args.get("hub.verify_token") == VERIFY_TOKEN:
-            return request.args.get("hub.challenge")
-        return "Error validacion", 403
+# --- WEBHOOK: MENSAJES Y ESTADOS ---
+ESTADOS_ENTREGA: Counter = Counter() # sent / delivered / read / failed (contadores del proceso)
 
-    # 2. PROCESAMIENTO (POST)
-    try:
-        body = request.get_json()
-        if not body or "entry" not in body:
-            return jsonify({"status": "ignored"}), 200
 
-        entry = body["entry"][0]["changes"][0]["value"]
-        if "messages" not in entry:
-            return jsonify({"status": "ok"}), 200 # Eventos de estado (sent, delivered)
+def registrar_estados(estados: List[Dict[str, Any]]) -> None:
+    """Eventos de estado de mensajes enviados: solo se cuentan (y se loguean los fallidos)."""
+    for estado in estados:
+        tipo = estado.get("status", "desconocido")
+        ESTADOS_ENTREGA[tipo] += 1
+        if tipo == "failed":
+            logging.warning(f"📵 Entrega fallida a {estado.get('recipient_id')}: {estado.get('errors')}")
 
-        msg = entry["messages"][0]
-        numero = msg["from"]
-        
-        # A) Rate Limiting (Delegate to Service)
-        if not check_rate_limit(numero):
-            logging.warning(f"⛔ Rate Limit {numero}")
-            return jsonify({"status": "rate_limited"}), 200
-        
-        # B) Deduplicación (Persistente en DB)
-        message_id = msg.get("id")
-        if message_id and db.check_message_id(message_id):
-            logging.info(f"🔁 Mensaje duplicado ignorado: {message_id}")
-            return jsonify({"status": "ignored_duplicate"}), 200
-
-        # C) Extracción Info
-        msg_type = msg.get("type")
-        texto = ""
-        imagen_bytes = None
-        audio_bytes = None
-
-        if msg_type == "text":
-            texto = msg.get("text", {}).get("body", "")
-        elif msg_type == "image":
-            texto = msg.get("image", {}).get("caption", "") or "Busco esto"
-            media_id = msg.get("image", {}).get("id")
-            imagen_bytes = descargar_media_meta(media_id)
-        elif msg_type == "audio":
-            media_id = msg.get("audio", {}).get("id")
-            logging.info(f"🎤 Audio recibido ID: {media_id}. Descargando...")
-            audio_bytes = descargar_media_meta(media_id)
-            texto = "[AUDIO RECIBIDO]" # Placeholder log
-        
-        nombre = entry.get("contacts", [{}])[0].get("profile", {}).get("name", "Cliente")
-
-        # D) Comandos Admin (Simplified logic call)
-        # (Aquí podríamos mover lógica Admin a un admin_service, pero por ahora lo dejamos simple o invocamos DB directo)
-        if texto.startswith("!db") or texto.startswith("!comandos") or texto.startswith("!modo"):
-             admin_numbers = os.environ.get("ADMIN_NUMBER", "").split(",")
-             es_admin = any(admin.strip() in numero for admin in admin_numbers if admin.strip())
-             
-             if es_admin:
-                 # --- COMANDO: !comandos ---
-                 if "!comandos" in texto:
-                     help_txt = """🛠️ *Panel de Admin GlamStore* 🛠️
+
+def procesar_mensaje(msg: Dict[str, Any], nombres: Dict[str, str]) -> str:
+    """Un mensaje entrante (ya deduplicado): comandos admin o despacho a su carril. Retorna el status."""
+    numero = msg["from"]
+
+    # A) Rate Limiting (Delegate to Service)
+    if not check_rate_limit(numero):
+        logging.warning(f"⛔ Rate Limit {numero}")
+        return "rate_limited"
+    
+    # B) Extracción Info
+    msg_type = msg.get("type")
+    texto = ""
+    imagen_id = None # Solo el ID: la descarga la hace el worker (atender_mensaje)
+    audio_id = None
+
+    if msg_type == "text":
+        texto = msg.get("text", {}).get("body", "")
+    elif msg_type == "image":
+        texto = msg.get("image", {}).get("caption", "") or "Busco esto"
+        imagen_id = msg.get("image", {}).get("id")
+    elif msg_type == "audio":
+        audio_id = msg.get("audio", {}).get("id")
+        texto = "[AUDIO RECIBIDO]" # Placeholder log
+    
+    nombre = nombres.get(numero, "Cliente")
+
+    # C) Comandos Admin (Simplified logic call)
+    # (Aquí podríamos mover lógica Admin a un admin_service, pero por ahora lo dejamos simple o invocamos DB directo)
+    if texto.startswith("!db") or texto.startswith("!comandos") or texto.startswith("!modo"):
+         admin_numbers = os.environ.get("ADMIN_NUMBER", "").split(",")
+         es_admin = any(admin.strip() in numero for admin in admin_numbers if admin.strip())
+         
+         if es_admin:
+             # --- COMANDO: !comandos ---
+             if "!comandos" in texto:
+                 help_txt = """🛠️ *Panel de Admin GlamStore* 🛠️
 
 1. *!db sync*
    🔄 Fuerza actualización inmediata con Shopify.
@@ -271,20 +332,20 @@ def webhook():
 5. *!modo vacaciones*
    🔴 Cierra ventas (Solo catálogo).
 """
-                     enviar_whatsapp(numero, help_txt)
-                     return jsonify({"status": "admin_cmd_help"}), 200
-
-                 # --- COMANDO: !db sync ---
-                 if "sync" in texto:
-                     threading.Thread(target=db.force_sync).start()
-                     enviar_whatsapp(numero, "⏳ *Sync Iniciado...* \n(Te avisaré si hay errores en el log, si no, asume éxito en 1 min).")
-                     return jsonify({"status": "admin_cmd_sync"}), 200
-
-                 # --- COMANDO: !db email ---
-                 if "email" in texto:
-                     # Render bloquea puertos SMTP (Email).
-                     # Mejor opción: Dar link a la vista web de Admin.
-                     msg = """📧 *Reporte de Base de Datos*
+                 enviar_whatsapp(numero, help_txt)
+                 return "admin_cmd_help"
+
+             # --- COMANDO: !db sync ---
+             if "sync" in texto:
+                 db.force_sync()
+                 enviar_whatsapp(numero, "⏳ *Sync Iniciado...* \n(Te avisaré si hay errores en el log, si no, asume éxito en 1 min).")
+                 return "admin_cmd_sync"
+
+             # --- COMANDO: !db email ---
+             if "email" in texto:
+                 # Render bloquea puertos SMTP (Email).
+                 # Mejor opción: Dar link a la vista web de Admin.
+                 msg = """📧 *Reporte de Base de Datos*
 El servidor de Render bloquea el envío de correos por seguridad. 🔒
 
 Pero tengo algo MEJOR:
@@ -292,39 +353,99 @@ Pero tengo algo MEJOR:
 https://agente-glamstore.onrender.com/admin/db
 
 (Desde ahí puedes ver todo el inventario actualizado al segundo)."""
-                     enviar_whatsapp(numero, msg)
-                     return jsonify({"status": "admin_cmd_email_redirect"}), 200
-
-                 # --- COMANDO: !modo ventas ---
-                 if "ventas" in texto and "modo" in texto:
-                     db.modo_vacaciones = False
-                     enviar_whatsapp(numero, "🟢 *¡MODO VENTAS ACTIVADO!* 💰\n✅ El bot ahora venderá y generará links de pago.\n✅ Mensajes de 'Vacaciones' desactivados.")
-                     return jsonify({"status": "admin_cmd_sales_mode"}), 200
-
-                 # --- COMANDO: !modo vacaciones ---
-                 if "vacaciones" in texto and "modo" in texto:
-                     db.modo_vacaciones = True
-                     enviar_whatsapp(numero, "🔴 *¡MODO VACACIONES ACTIVADO!* 🌴\n⛔ Ventas pausadas. El bot solo mostrará el catálogo (Modo Revista).")
-                     return jsonify({"status": "admin_cmd_vacation_mode"}), 200
-
-             return jsonify({"status": "admin_cmd_ignored"}), 200
-
-        # E) Gestión Memoria Usuario
-        if numero not in MEMORIA_USUARIOS:
-            MEMORIA_USUARIOS[numero] = {'historial': deque(maxlen=6), 'msg_map': {}}
-        usuario = MEMORIA_USUARIOS[numero]
-        historial_txt = "\n".join([f"U: {h['txt']}\nB: {h['resp']}" for h in usuario['historial']])
-        msg_context_id = msg.get("context", {}).get("id")
-
-        # F) INVOCAR CEREBRO IA (Service Call)
-        # Auto-sync check
-        db.trigger_sync_if_stale(minutes=30)
-        
-        threading.Thread(target=procesar_inteligencia_artificial, args=(
-            numero, nombre, texto, historial_txt, usuario, msg_context_id, imagen_bytes, audio_bytes
-        )).start()
-        
-        return jsonify({"status": "ok"}), 200
+                 enviar_whatsapp(numero, msg)
+                 return "admin_cmd_email_redirect"
+
+             # --- COMANDO: !modo ventas ---
+             if "ventas" in texto and "modo" in texto:
+                 db.modo_vacaciones = False
+                 enviar_whatsapp(numero, "🟢 *¡MODO VENTAS ACTIVADO!* 💰\n✅ El bot ahora venderá y generará links de pago.\n✅ Mensajes de 'Vacaciones' desactivados.")
+                 return "admin_cmd_sales_mode"
+
+             # --- COMANDO: !modo vacaciones ---
+             if "vacaciones" in texto and "modo" in texto:
+                 db.modo_vacaciones = True
+                 enviar_whatsapp(numero, "🔴 *¡MODO VACACIONES ACTIVADO!* 🌴\n⛔ Ventas pausadas. El bot solo mostrará el catálogo (Modo Revista).")
+                 return "admin_cmd_vacation_mode"
+
+         return "admin_cmd_ignored"
+
+    # D) Contexto del mensaje (la memoria del usuario se lee al procesarlo, en su carril)
+    msg_context_id = msg.get("context", {}).get("id")
+
+    # E) INVOCAR CEREBRO IA (Service Call)
+    # Auto-sync check
+    db.trigger_sync_if_stale(minutes=30)
+    
+    encolado = DESPACHADOR_WEBHOOK.enviar(numero, {
+        "nombre": nombre, "texto": texto, "msg_context_id": msg_context_id,
+        "imagen_id": imagen_id, "audio_id": audio_id
+    })
+    if not encolado:
+        logging.warning(f"🚦 Webhook sin cupo (cola o carril lleno). Respuesta de ocupado a {numero}")
+        avisar_ocupado(numero)
+        return "busy"
+    
+    return "ok"
+
+
+# --- WEBHOOK PRINCIPAL ---
+@app.route("/webhook", methods=["GET", "POST"])
+def webhook():
+    # 1. VERIFICACIÓN (GET)
+    if request.method == "GET":
+        if request.args.get("hub.verify_token") == VERIFY_TOKEN:
+            return request.args.get("hub.challenge")
+        return "Error validacion", 403
+
+    # 2. PROCESAMIENTO (POST)
+    # Meta agrupa varias entradas / cambios / mensajes en un mismo POST bajo carga: se procesan todos.
+    try:
+        body = request.get_json()
+        if not body or "entry" not in body:
+            return jsonify({"status": "ignored"}), 200
+
+        mensajes = [] # (mensaje, nombres del cambio)
+        for entry in body.get("entry") or []:
+            for change in entry.get("changes") or []:
+                value = change.get("value") or {}
+                if value.get("statuses"):
+                    registrar_estados(value["statuses"]) # sent / delivered / read / failed
+                nombres = {
+                    c.get("wa_id"): c.get("profile", {}).get("name", "Cliente") for c in value.get("contacts") or []
+                }
+                for msg in value.get("messages") or []:
+                    mensajes.append((msg, nombres))
+
+        if not mensajes:
+            return jsonify({"status": "ok"}), 200 # Solo eventos de estado
+
+        # Deduplicación del lote completo (una transacción en DB)
+        duplicados = db.check_message_ids([msg.get("id") for msg, _ in mensajes if msg.get("id")])
+
+        resultados = []
+        vistos = set() # Reenvíos del mismo mensaje dentro del lote: solo la primera aparición
+        no_aceptados = [] # Rate limit / error: se desmarcan para que un reenvío de Meta sí se procese
+        for msg, nombres in mensajes:
+            message_id = msg.get("id")
+            if message_id in duplicados or message_id in vistos:
+                logging.info(f"🔁 Mensaje duplicado ignorado: {message_id}")
+                resultados.append("ignored_duplicate")
+                continue
+            if message_id:
+                vistos.add(message_id)
+            try:
+                resultado = procesar_mensaje(msg, nombres)
+            except Exception as e: # Un mensaje roto no descarta al resto del lote
+                logging.error(f"🔥 Error procesando mensaje {msg.get('id')}: {e}")
+                resultado = "error"
+            if resultado in ("rate_limited", "error"):
+                no_aceptados.append(message_id)
+            resultados.append(resultado)
+        db.liberar_message_ids(no_aceptados)
+
+        status = resultados[0] if len(resultados) == 1 else "batch"
+        return jsonify({"status": status, "mensajes": resultados}), 200
 
     except Exception as e:
         logging.error(f"🔥 Error Webhook Controller: {e}")
@@ -0,0 +1,116 @@
+"""
+Benchmark del scorer de keywords: Python (posting lists) vs NumPy (vectorizado).
+Catálogos sintéticos de 1k, 10k y 100k productos. Verifica que ambos den el mismo top-5.
+
+Uso: python bench_search.py [tamaños...]   (ej: python bench_search.py 1000 10000)
+"""
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+from typing import List, Dict, Any, Tuple, Set
+
+from database import GlamStoreDB
+from services.search_index import normalizar, stem, extraer_rango_precio
+from services import vector_scorer
+
+MARCAS = ["Lattafa", "Maison Alhambra", "Armaf", "Rasasi", "Loreal", "Maybelline", "Revlon", "Nivea", "Dove", "Garnier"]
+TIPOS = ["Perfume", "Shampoo", "Acondicionador", "Labial", "Crema", "Serum", "Brillo", "Mascara", "Base", "Tratamiento"]
+ATRIBUTOS = ["rojo", "mate", "argan", "elixir", "intenso", "floral", "vainilla", "hidratante", "edp", "edt", "keratina", "coco"]
+
+# Consultas que caen en la Estrategia 2 (sin marca ni sinónimo de categoría)
+CONSULTAS = [
+    "rojo mate",
+    "argan elixir",
+    "vainilla intenso hasta 20 mil",
+    "coco keratina",
+    "rojos mates entre 10 y 30 mil",
+    "edp elixir intenso",
+    "edt",
+    "vainillas",
+]
+
+
+def catalogo_sintetico(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    productos = []
+    for i in range(n):
+        marca = rnd.choice(MARCAS)
+        tipo = rnd.choice(TIPOS)
+        attrs = rnd.sample(ATRIBUTOS, 3)
+        titulo = f"{tipo} {' '.join(attrs)} {i}"
+        productos.append({
+            "id": i + 1,
+            "title": titulo,
+            "vendor": marca,
+            "category": tipo,
+            "price": rnd.randrange(3000, 60000, 10),
+            "search_text": normalizar(f"{titulo} {marca} {tipo} {' '.join(rnd.sample(ATRIBUTOS, 2))}"),
+        })
+    return productos
+
+
+def preparar(db: GlamStoreDB, consulta: str) -> Tuple[List[str], List[str], List[str], Any, Set[int]]:
+    """Mismos insumos que arma _resolver_busqueda antes de puntuar."""
+    texto = db._normalizar(consulta)
+    keywords = [w for w in texto.split() if w not in db.palabras_basura and len(w) > 2]
+    stems = [stem(kw) for kw in keywords]
+    bigramas = [f"{keywords[i]} {keywords[i+1]}" for i in range(len(keywords) - 1)]
+    rango = extraer_rango_precio(consulta)
+    ids_precio = db._indice.ids_en_rango(rango) if rango else set()
+    return keywords, stems, bigramas, rango, ids_precio
+
+
+def medir(db: GlamStoreDB, scorer: str, entradas: List[Tuple], repeticiones: int) -> float:
+    """Milisegundos promedio por consulta (solo el scoring, sin caché de consultas)."""
+    indice = db._indice
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        indice._memo_substrings = {} # Cada repetición cuenta como consulta nueva
+        for keywords, stems, bigramas, rango, ids_precio in entradas:
+            if scorer == "numpy":
+                indice.vectorial().top(keywords, stems, rango)
+            else:
+                db._top_keywords(indice, keywords, stems, bigramas, rango, ids_precio)
+    return (time.perf_counter() - inicio) * 1000 / (repeticiones * len(entradas))
+
+
+def main(tamanos: List[int]) -> None:
+    if not vector_scorer.disponible():
+        print("❌ NumPy no está instalado (pip install numpy)")
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = GlamStoreDB(db_path=os.path.join(tmp, "bench.db"))
+        db.shopify_token = None
+
+        print(f"{'productos':>10} | {'índice':>9} | {'matriz':>9} | {'python':>10} | {'numpy':>10} | speedup")
+        for n in tamanos:
+            t0 = time.perf_counter()
+            db.productos = catalogo_sintetico(n)
+            t_indice = (time.perf_counter() - t0) * 1000
+
+            indice = db._indice
+            t0 = time.perf_counter()
+            indice.vectorial()
+            t_matriz = (time.perf_counter() - t0) * 1000
+
+            # Paridad: mismo top-5 en ambos scorers
+            entradas = [preparar(db, q) for q in CONSULTAS]
+            for q, (keywords, stems, bigramas, rango, ids_precio) in zip(CONSULTAS, entradas):
+                esperado = db._top_keywords(indice, keywords, stems, bigramas, rango, ids_precio)
+                obtenido = indice.vectorial().top(keywords, stems, rango)
+                if esperado != obtenido:
+                    print(f"❌ Difiere '{q}' (n={n}): python={esperado} numpy={obtenido}")
+
+            repeticiones = max(1, 20000 // n)
+            ms_py = medir(db, "python", entradas, repeticiones)
+            ms_np = medir(db, "numpy", entradas, repeticiones)
+            print(f"{n:>10} | {t_indice:>7.0f}ms | {t_matriz:>7.0f}ms | {ms_py:>8.2f}ms | {ms_np:>8.2f}ms | {ms_py / ms_np:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
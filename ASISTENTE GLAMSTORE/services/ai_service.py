@@ -135,13 +135,13 @@ def procesar_inteligencia_artificial(
     mostrar_imagenes = True
 
     # 1. CLASIFICACION INTENCION (Soporte, Cierre, Saludo, Catalogo)
-    keywords_soporte = ["donde", "dónde", "ubicacion", "ubicación", "calle", "lugar", "horario", "hora", "cuando", "cuándo", "telefono", "celular", "que venden", "qué venden", "mayorista"]
-    frases_cierre = ["eso seria", "eso sería", "eso es todo", "eso nomas", "eso nomás", "nada mas", "nada más", "solo eso", "sólo eso", "listo", "ok", "gracias", "ya", "dame link", "generar link", "quiero pagar", "pagar", "link", "el link"]
+    # Frases de soporte/cierre/compra/referencia: db.intenciones_map (un solo autómata, una pasada)
     saludos_cortos = ["hola", "buenas", "buenos dias", "buenas tardes", "holis", "alo"]
     
     texto_lower = texto.lower().strip()
-    es_soporte = any(k in texto_lower for k in keywords_soporte)
-    es_cierre = any(f in texto_lower for f in frases_cierre)
+    intenciones = {c.tipo for c in db.detectar_frases(texto)}
+    es_soporte = "soporte" in intenciones
+    es_cierre = "cierre" in intenciones
     
     # Limpieza saludo
     texto_limpio_saludo = re.sub(r'[^\w\s]', '', texto_lower).strip()
@@ -218,13 +218,13 @@ def procesar_inteligencia_artificial(
              res = {"tipo": "RECOMENDACION_REAL", "items": items_random}
              logging.info(f"🎲 Random items selected: {len(items_random)}")
          else:
-             res = db.buscar_contextual(texto)
+             # Semilla por cliente + consulta: misma pregunta -> misma respuesta (reproducible/cacheable)
+             res = db.buscar_contextual(texto, seed=f"{numero}:{texto}")
          
          # Omitimos logica 'sinonimos' detallada para no duplicar demasiado código, pero base busca bien.
 
     # Producto Foco override (Quote o Fallback Contextual)
-    keywords_referencia = ["este", "ese", "quiero", "llevo", "dame", "precio", "cuanto", "comprar"]
-    es_referencia = any(k in texto.lower() for k in keywords_referencia)
+    es_referencia = "referencia" in intenciones
 
     if producto_foco and es_referencia:
         res["items"] = [producto_foco]
@@ -258,7 +258,6 @@ def procesar_inteligencia_artificial(
             contexto_data = f"PRODUCTO ENCONTRADO:\n{lista}"
 
         # MODO VACACIONES LOGIC
-        keywords_compra = ["comprar", "llevo", "generame el link", "dame el link", "link de pago", "pagar", "cuenta", "transferencia", "tarjeta"]
         
         if db.modo_vacaciones:
              contexto_data = "⚠️ AVISO IMPORTANTE: ESTAMOS DE VACACIONES HASTA MARZO.\n" + contexto_data
@@ -269,7 +268,7 @@ def procesar_inteligencia_artificial(
              return
 
         # Checkout Logic (Selector Inteligente)
-        if any(k in texto.lower() for k in keywords_compra):
+        if "compra" in intenciones:
             # ... (Logica selector JSON omitida por brevedad del bloque, pero funcionalmente aqui iría)
             # Para mantener este archivo escribible, asumiremos que si MODO VACACIONES esta activo
             # NUNCA llegamos a generar link de pago real porque el prompt lo impide o el if anterior atrapa.
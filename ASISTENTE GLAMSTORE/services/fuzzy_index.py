@@ -0,0 +1,131 @@
+import heapq
+from collections import defaultdict, Counter
+from itertools import chain
+from typing import List, Dict, Iterable, Optional, Set
+
+# Máximo de candidatas (las que más trigramas comparten) a las que se les calcula distancia
+MAX_CANDIDATAS = 48
+
+
+def _trigramas(palabra: str) -> Set[str]:
+    """Trigramas con relleno ("$$ab", ...) para que los bordes también cuenten."""
+    w = f"$${palabra}$$"
+    return {w[i:i + 3] for i in range(len(w) - 2)}
+
+
+def distancia_edicion(a: str, b: str, tope: int) -> int:
+    """
+    Distancia Damerau (OSA): inserción, borrado, sustitución y transposición adyacente.
+    Corta temprano: si toda la fila supera `tope`, retorna tope + 1.
+    """
+    if abs(len(a) - len(b)) > tope:
+        return tope + 1
+
+    previa2: List[int] = []
+    previa = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            costo = 0 if a[i - 1] == b[j - 1] else 1
+            actual[j] = min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + costo)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                actual[j] = min(actual[j], previa2[j - 2] + 1)
+        if min(actual) > tope:
+            return tope + 1
+        previa2, previa = previa, actual
+    return previa[-1]
+
+
+def presupuesto_edicion(palabra: str) -> int:
+    """Errores tolerados según largo: <=3 letras ninguno, 4-5 uno, 6+ dos."""
+    if len(palabra) <= 3: return 0
+    if len(palabra) <= 5: return 1
+    return 2
+
+
+class TrigramIndex:
+    """
+    Índice de trigramas sobre el vocabulario del catálogo.
+    Mapea una palabra mal escrita ("lataffa", "alambra") a la palabra del catálogo
+    más cercana dentro del presupuesto de edición. Solo compara contra palabras de
+    largo compatible que comparten suficientes trigramas, no contra todo el vocabulario.
+    """
+    def __init__(self, vocabulario: Iterable[str], frecuencias: Optional[Dict[str, int]] = None) -> None:
+        self._frecuencias = frecuencias or {}
+        # largo de palabra -> trigrama -> palabras (el filtro de largo sale gratis)
+        postings: Dict[int, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+        for palabra in vocabulario:
+            if not palabra.isalpha(): continue # Medidas, códigos y números no se corrigen
+            por_tri = postings[len(palabra)]
+            for tri in _trigramas(palabra):
+                por_tri[tri].append(palabra)
+        self._postings: Dict[int, Dict[str, List[str]]] = {largo: dict(d) for largo, d in postings.items()}
+
+    def con_cambios(
+        self,
+        agregadas: Iterable[str],
+        quitadas: Iterable[str],
+        frecuencias: Optional[Dict[str, int]] = None
+    ) -> "TrigramIndex":
+        """
+        Copia con palabras agregadas/quitadas del vocabulario (para snapshots por delta).
+        Solo se copian los largos y listas de trigramas que se tocan; el original queda intacto.
+        """
+        nuevo = TrigramIndex((), frecuencias)
+        nuevo._postings = dict(self._postings)
+        copiados: Set[int] = set()
+
+        def _por_tri(largo: int) -> Dict[str, List[str]]:
+            if largo not in copiados:
+                nuevo._postings[largo] = dict(nuevo._postings.get(largo, {}))
+                copiados.add(largo)
+            return nuevo._postings[largo]
+
+        for palabra in quitadas:
+            if not palabra.isalpha() or len(palabra) not in self._postings: continue
+            por_tri = _por_tri(len(palabra))
+            for tri in _trigramas(palabra):
+                lista = [w for w in por_tri.get(tri, ()) if w != palabra]
+                if lista:
+                    por_tri[tri] = lista
+                else:
+                    por_tri.pop(tri, None)
+        for palabra in agregadas:
+            if not palabra.isalpha(): continue
+            por_tri = _por_tri(len(palabra))
+            for tri in _trigramas(palabra):
+                por_tri[tri] = por_tri.get(tri, []) + [palabra]
+        return nuevo
+
+    def corregir(self, palabra: str, tope: Optional[int] = None) -> Optional[str]:
+        """Palabra del vocabulario más cercana (menor distancia, luego la más frecuente) o None."""
+        tope = presupuesto_edicion(palabra) if tope is None else tope
+        if tope <= 0:
+            return None
+
+        tris = _trigramas(palabra)
+        # Lema de q-gramas: cada edición destruye a lo más 3 trigramas
+        minimo_comun = max(1, len(tris) - 3 * tope)
+
+        # Conteo de trigramas compartidos (Counter cuenta en C), solo en largos alcanzables
+        listas = []
+        for largo in range(len(palabra) - tope, len(palabra) + tope + 1):
+            por_tri = self._postings.get(largo)
+            if por_tri:
+                listas.extend(por_tri.get(tri, ()) for tri in tris)
+        comunes = Counter(chain.from_iterable(listas))
+
+        candidatas = [(n, c) for c, n in comunes.items() if n >= minimo_comun and c != palabra]
+        mejor: Optional[str] = None
+        mejor_clave = None
+        for n, candidata in heapq.nlargest(MAX_CANDIDATAS, candidatas):
+            # Ya hay una a distancia d: las que comparten menos de |tris| - 3d trigramas no pueden empatarla
+            if mejor_clave is not None and n < len(tris) - 3 * mejor_clave[0]:
+                break
+            d = distancia_edicion(palabra, candidata, tope)
+            if d > tope:
+                continue
+            clave = (d, -self._frecuencias.get(candidata, 0), candidata)
+            if mejor_clave is None or clave < mejor_clave:
+                mejor, mejor_clave = candidata, clave
+        return mejor
@@ -0,0 +1,79 @@
+import os
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Tuple, Union
+
+# Conexiones keep-alive por host (gunicorn threads + prefetch de la sync pueden ir en paralelo)
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+# (conexión, lectura) en segundos para llamadas que no indiquen el suyo
+HTTP_TIMEOUT: Tuple[float, float] = (
+    float(os.environ.get("HTTP_TIMEOUT_CONEXION", 5)),
+    float(os.environ.get("HTTP_TIMEOUT_LECTURA", 30))
+)
+
+
+class HttpClient:
+    """
+    Cliente HTTP compartido: una `requests.Session` por host (Shopify, graph.facebook.com,
+    CDN de media...), así cada llamada reutiliza la conexión TCP+TLS en vez de abrir otra.
+    - Timeout por defecto en toda llamada (antes varias no tenían).
+    - Accept-Encoding gzip.
+    - `stats()`: requests y conexiones nuevas por host (reutilizadas = requests - nuevas).
+    """
+    def __init__(self, pool_maxsize: int = HTTP_POOL_MAXSIZE, timeout: Union[float, Tuple[float, float]] = HTTP_TIMEOUT) -> None:
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._sesiones: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def sesion(self, url: str) -> requests.Session:
+        host = urlsplit(url).netloc.lower()
+        sesion = self._sesiones.get(host)
+        if sesion is None:
+            with self._lock:
+                sesion = self._sesiones.get(host)
+                if sesion is None:
+                    sesion = requests.Session()
+                    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                    sesion.mount("https://", adaptador)
+                    sesion.mount("http://", adaptador)
+                    sesion.headers["Accept-Encoding"] = "gzip, deflate"
+                    self._sesiones[host] = sesion
+        return sesion
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.sesion(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Por host: requests hechos, conexiones abiertas y reutilizaciones (según los pools de urllib3)."""
+        resultado: Dict[str, Dict[str, int]] = {}
+        for host, sesion in list(self._sesiones.items()):
+            total = nuevas = 0
+            for adaptador in {id(a): a for a in sesion.adapters.values()}.values():
+                pools = adaptador.poolmanager.pools
+                for clave in list(pools.keys()):
+                    pool = pools.get(clave)
+                    if pool is not None:
+                        total += pool.num_requests
+                        nuevas += pool.num_connections
+            resultado[host] = {"requests": total, "conexiones": nuevas, "reutilizadas": max(0, total - nuevas)}
+        return resultado
+
+    def cerrar(self) -> None:
+        with self._lock:
+            for sesion in self._sesiones.values():
+                sesion.close()
+            self._sesiones.clear()
+
+
+# Instancia compartida del proceso (igual que `db`)
+http_client = HttpClient()
@@ -0,0 +1,63 @@
+from collections import deque
+from typing import List, Dict, Any, Iterable, Tuple, NamedTuple
+
+
+class Coincidencia(NamedTuple):
+    """Frase detectada en el texto del usuario."""
+    tipo: str    # "vendor", "categoria", "soporte", "cierre", "compra", "referencia"...
+    valor: Any   # Payload asociado (marca normalizada, nombre de categoría, etc.)
+    frase: str   # Patrón que hizo match
+    inicio: int  # Posición en el texto
+
+
+class PhraseMatcher:
+    """
+    Autómata Aho-Corasick: encuentra TODAS las frases registradas en una sola
+    pasada lineal sobre el texto, sin importar cuántas marcas o frases haya.
+    Semántica de substring (igual que `frase in texto`).
+    """
+    def __init__(self, frases: Iterable[Tuple[str, str, Any]]) -> None:
+        """`frases`: tuplas (frase, tipo, valor). Las frases deben venir normalizadas."""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, Any, str]]] = [[]]
+
+        # 1. Trie
+        for frase, tipo, valor in frases:
+            if not frase: continue
+            nodo = 0
+            for ch in frase:
+                sig = self._goto[nodo].get(ch)
+                if sig is None:
+                    sig = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[nodo][ch] = sig
+                nodo = sig
+            self._out[nodo].append((tipo, valor, frase))
+
+        # 2. Links de fallo (BFS). Los hijos de la raíz fallan a la raíz.
+        cola = deque(self._goto[0].values())
+        while cola:
+            r = cola.popleft()
+            for ch, u in self._goto[r].items():
+                cola.append(u)
+                f = self._fail[r]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[u] = self._goto[f].get(ch, 0)
+                self._out[u] = self._out[u] + self._out[self._fail[u]]
+
+    def buscar(self, texto: str) -> List[Coincidencia]:
+        """Todas las coincidencias (con solapamiento) en orden de aparición."""
+        goto, fail, out = self._goto, self._fail, self._out
+        nodo = 0
+        resultado: List[Coincidencia] = []
+        for i, ch in enumerate(texto):
+            while nodo and ch not in goto[nodo]:
+                nodo = fail[nodo]
+            nodo = goto[nodo].get(ch, 0)
+            for tipo, valor, frase in out[nodo]:
+                resultado.append(Coincidencia(tipo, valor, frase, i - len(frase) + 1))
+        return resultado
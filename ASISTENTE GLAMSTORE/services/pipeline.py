@@ -0,0 +1,50 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_FIN = object()
+
+
+def prefetch(fuente: Iterable[T], max_pendientes: int = 2, nombre: str = "prefetch") -> Iterator[T]:
+    """
+    Productor/consumidor: un hilo recorre `fuente` (ej: páginas de Shopify vía red)
+    mientras quien itera procesa el elemento actual (parseo + escritura en SQLite).
+    La cola acotada (`max_pendientes`) frena al productor si el consumidor va lento.
+    Los errores del productor se re-lanzan en el consumidor, en orden.
+    Si el consumidor deja de iterar, el productor se detiene en su próximo `put`.
+    """
+    cola: "queue.Queue" = queue.Queue(maxsize=max(1, max_pendientes))
+    detener = threading.Event()
+
+    def _encolar(item, error) -> bool:
+        while not detener.is_set():
+            try:
+                cola.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _productor() -> None:
+        try:
+            for item in fuente:
+                if not _encolar(item, None):
+                    return
+            _encolar(_FIN, None)
+        except BaseException as e: # Se entrega al consumidor tal cual
+            _encolar(_FIN, e)
+
+    hilo = threading.Thread(target=_productor, name=nombre, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            item, error = cola.get()
+            if item is _FIN:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        detener.set()
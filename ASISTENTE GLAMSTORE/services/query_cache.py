@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Hashable
+
+
+class QueryCache:
+    """
+    Caché LRU + TTL para resultados de búsqueda.
+    Cada entrada queda etiquetada con la versión del catálogo con que se calculó:
+    si el catálogo se recarga (versión nueva), la entrada cuenta como miss.
+    """
+    def __init__(self, max_items: int = 256, ttl_seconds: float = 600.0) -> None:
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict() # clave -> (version, expira, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clave: Hashable, version: int) -> Optional[Any]:
+        with self._lock:
+            entrada = self._data.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            ver, expira, valor = entrada
+            if ver != version or expira < time.monotonic():
+                del self._data[clave]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(clave) # LRU: recién usado al final
+            self.hits += 1
+            return valor
+
+    def put(self, clave: Hashable, valor: Any, version: int) -> None:
+        if self.max_items <= 0: return
+        with self._lock:
+            self._data[clave] = (version, time.monotonic() + self.ttl_seconds, valor)
+            self._data.move_to_end(clave)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False) # Expulsa el menos usado
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entradas": len(self._data),
+            "max": self.max_items,
+            "ttl_s": self.ttl_seconds
+        }
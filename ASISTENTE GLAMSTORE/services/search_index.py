@@ -0,0 +1,448 @@
+import re
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import List, Dict, Any, Set, FrozenSet, Optional, Tuple, Iterable
+from services.phrase_matcher import PhraseMatcher, Coincidencia
+from services.fuzzy_index import TrigramIndex
+from services.vector_scorer import VectorScorer
+
+# Tope del memo de substrings por snapshot (evita crecer sin límite entre syncs)
+MAX_MEMO_SUBSTRINGS = 4096
+# Deltas que tocan más de esta fracción del catálogo se reconstruyen completos
+MAX_FRACCION_DELTA = 0.2
+
+
+def normalizar(texto: Optional[str]) -> str:
+    """Minúsculas, sin tildes y sin '?' ni ','. Misma regla para catálogo y consultas."""
+    if not texto: return ""
+
+    try:
+        text_str = str(texto).replace("?", " ").replace(",", " ")
+        return unicodedata.normalize('NFKD', text_str).encode('ASCII', 'ignore').decode('utf-8').lower().strip()
+    except:
+        return str(texto).lower()
+
+
+# Plurales en -es cuya raíz termina en estas consonantes: labiales -> labial, colores -> color
+_CONSONANTES_PLURAL_ES = set("lrndj")
+
+
+def stem(palabra: str) -> str:
+    """
+    Stemmer liviano de plurales en español (sobre texto ya normalizado):
+      shampoos -> shampoo, alhambras -> alhambra, labiales -> labial, luces -> luz.
+    Conservador a propósito: solo pliega plurales, no conjuga ni quita sufijos.
+    """
+    if len(palabra) <= 3 or not palabra.isalpha():
+        return palabra
+    if palabra.endswith("ces"):
+        return palabra[:-3] + "z"
+    if palabra.endswith("es") and palabra[-3] in _CONSONANTES_PLURAL_ES and len(palabra) > 4:
+        return palabra[:-2]
+    if palabra.endswith("s") and palabra[-2] in "aeiou":
+        return palabra[:-1]
+    return palabra
+
+
+def stem_texto(texto_norm: str) -> str:
+    """Aplica `stem` a cada palabra. Se calcula una vez por producto (en la sync) y una vez por consulta."""
+    return " ".join(stem(w) for w in texto_norm.split())
+
+
+# Rango de precio pedido por el usuario: (mínimo, máximo). máximo=None -> sin tope.
+RangoPrecio = Tuple[int, Optional[int]]
+
+# Número (decimal opcional: "1.5 mil") con sufijo opcional "mil"/"k" ("15 mil", "15mil", "15k").
+# Debe terminar ahí (?!\w) y no ser una medida ("1000ml", "500 ml", "100 gr").
+_UNIDADES = r'(?!\s*(?:ml|cc|gr|g|kg|oz|cm|mm|lt|l)\b)'
+_NUM = r'(\d{1,7}(?:\.\d+)?)(\s*(?:mil|k))?(?!\w)' + _UNIDADES
+_RE_ENTRE = re.compile(r'\bentre\s+' + _NUM + r'\s+(?:y|a)\s+' + _NUM)
+_RE_TOPE = re.compile(r'\b(?:menos de|hasta|maximo|bajo|no mas de)\s+(?:los\s+)?' + _NUM)
+_RE_PISO = re.compile(r'\b(?:mas de|desde|sobre|minimo|arriba de)\s+(?:los\s+)?' + _NUM)
+_RE_EXACTO = re.compile(r'\b' + _NUM)
+
+
+def _valor(numero: str, sufijo_mil: Optional[str], forzar_miles: bool = False) -> int:
+    valor = float(numero)
+    # En frases de rango un número chico son miles ("entre 5 y 15" = $5.000 - $15.000)
+    if sufijo_mil or (forzar_miles and valor < 1000):
+        valor *= 1000
+    return int(round(valor))
+
+
+def extraer_rango_precio(texto: str) -> Optional[RangoPrecio]:
+    """
+    Interpreta precios del mensaje (precios típicos CL):
+      "3000" / "3.000" / "3 mil"  -> (3000, 3000) exacto
+      "menos de 10000" / "hasta 10 mil" -> (0, 10000)
+      "desde 5000" / "mas de 5 mil"     -> (5000, None)
+      "entre 5 y 15 mil"                -> (5000, 15000)
+    """
+    # Coma decimal/miles antes de normalizar (normalizar borra las comas): "1,5 mil" / "12,990"
+    t = re.sub(r'(?<=\d),(?=\d{3}\b)', '', texto or "")
+    t = re.sub(r'(?<=\d),(?=\d{1,2}\b)', '.', t)
+    t = normalizar(t).replace("$", " ")
+    t = re.sub(r'(?<=\d)\.(?=\d{3}\b)', '', t) # Separador de miles: 10.000 -> 10000
+
+    m = _RE_ENTRE.search(t)
+    if m:
+        a = _valor(m.group(1), m.group(2), forzar_miles=True)
+        b = _valor(m.group(3), m.group(4), forzar_miles=True)
+        return (min(a, b), max(a, b))
+
+    m = _RE_TOPE.search(t)
+    if m:
+        return (0, _valor(m.group(1), m.group(2), forzar_miles=True))
+
+    m = _RE_PISO.search(t)
+    if m:
+        return (_valor(m.group(1), m.group(2), forzar_miles=True), None)
+
+    # Precio exacto: solo números "de precio" (entre 1000 y 1000000)
+    for m in _RE_EXACTO.finditer(t):
+        valor = _valor(m.group(1), m.group(2))
+        if 1000 <= valor <= 1000000:
+            return (valor, valor)
+    return None
+
+
+class SearchIndex:
+    """
+    Snapshot inmutable del catálogo en memoria + índices de búsqueda.
+    Se construye completo fuera de línea y se publica con una sola asignación,
+    así los hilos que están buscando nunca ven un índice a medio armar.
+    Los cambios chicos no reconstruyen todo: `aplicar_delta` arma el snapshot
+    siguiente re-indexando solo los productos afectados.
+    """
+    def __init__(
+        self,
+        productos: List[Dict[str, Any]],
+        categorias_map: Optional[Dict[str, List[str]]] = None,
+        intenciones_map: Optional[Dict[str, List[str]]] = None,
+        version: int = 0
+    ) -> None:
+        self.productos: List[Dict[str, Any]] = productos
+        self.version: int = version # Versión del catálogo (etiqueta para la caché de consultas)
+        self._categorias_map: Dict[str, List[str]] = categorias_map or {}
+        self._intenciones_map: Dict[str, List[str]] = intenciones_map or {}
+        self.por_id: Dict[int, Dict[str, Any]] = {}
+        self.orden: Dict[int, int] = {}  # ID -> posición original (desempate estable)
+
+        # Campos normalizados una sola vez por carga (antes se re-normalizaban en cada mensaje)
+        self.vendor_norm: Dict[int, str] = {}
+        self.category_norm: Dict[int, str] = {}
+        self.tags_norm: Dict[int, str] = {}
+        self.stem_text: Dict[int, str] = {}
+        self._precio: Dict[int, int] = {} # ID -> int(price), solo precios parseables
+
+        # Índice invertido: token normalizado de search_text -> IDs de producto
+        postings: Dict[str, Set[int]] = defaultdict(set)
+        # Índice de stems (columna search_stem, precalculada en la sync): stem -> IDs
+        postings_stem: Dict[str, Set[int]] = defaultdict(set)
+
+        for pos, p in enumerate(productos):
+            p_id = p['id']
+            self.por_id[p_id] = p
+            self.orden[p_id] = pos
+            self._indexar(p)
+
+            for token in (p.get('search_text') or "").split():
+                postings[token].add(p_id)
+            for token in self.stem_text[p_id].split():
+                postings_stem[token].add(p_id)
+
+        self.postings: Dict[str, FrozenSet[int]] = {t: frozenset(ids) for t, ids in postings.items()}
+        self.postings_stem: Dict[str, FrozenSet[int]] = {t: frozenset(ids) for t, ids in postings_stem.items()}
+        # Tolerancia a typos: trigramas sobre el vocabulario (desempate por frecuencia en el catálogo)
+        self._frecuencias: Dict[str, int] = {t: len(ids) for t, ids in self.postings.items()}
+        self.fuzzy = TrigramIndex(self.postings, self._frecuencias)
+        self._armar_precios()
+        self._memo_substrings: Dict[str, FrozenSet[int]] = {}
+        self._vectorial: Optional[VectorScorer] = None # Se arma solo si se usa SEARCH_SCORER=numpy
+
+        self._armar_tablas()
+        self.matcher = self._armar_matcher()
+
+    def _indexar(self, p: Dict[str, Any]) -> None:
+        """Campos derivados de un producto (normalizados, stems, precio)."""
+        p_id = p['id']
+        self.vendor_norm[p_id] = normalizar(p.get('vendor'))
+        self.category_norm[p_id] = normalizar(p.get('category'))
+        self.tags_norm[p_id] = normalizar(p.get('tags'))
+        # Filas antiguas o sin columna: se calcula aquí (al cargar), nunca por consulta
+        self.stem_text[p_id] = p.get('search_stem') or stem_texto(p.get('search_text') or "")
+        try:
+            self._precio[p_id] = int(p['price'])
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    def _desindexar(self, p_id: int) -> None:
+        for campos in (self.vendor_norm, self.category_norm, self.tags_norm, self.stem_text, self._precio):
+            campos.pop(p_id, None)
+
+    def _armar_precios(self) -> None:
+        # Índice de precios: pares (int(price), ID) ordenados -> rangos por bisect
+        pares_precio = sorted((precio, p_id) for p_id, precio in self._precio.items())
+        self._precios_ordenados: List[int] = [precio for precio, _ in pares_precio]
+        self._ids_por_precio: List[int] = [p_id for _, p_id in pares_precio]
+
+    def _armar_tablas(self) -> None:
+        """Marca -> productos y categoría -> productos, en orden de catálogo."""
+        # Marca normalizada -> productos (en orden de catálogo)
+        self.por_vendor: Dict[str, List[Dict[str, Any]]] = {}
+        for p in self.productos:
+            vendor = self.vendor_norm[p['id']]
+            if vendor:
+                self.por_vendor.setdefault(vendor, []).append(p)
+
+        # Categoría del mapa de intención -> productos cuya categoría o tags la contienen
+        self.por_categoria: Dict[str, List[Dict[str, Any]]] = {}
+        for cat in self._categorias_map:
+            cat_norm = normalizar(cat)
+            self.por_categoria[cat] = [
+                p for p in self.productos
+                if cat_norm in self.category_norm[p['id']] or cat_norm in self.tags_norm[p['id']]
+            ]
+        self.rank_vendor: Dict[str, int] = {v: i for i, v in enumerate(self.por_vendor)}
+
+    def _parchar_tablas(self, anterior: "SearchIndex", salen: Set[int], entran: Set[int]) -> None:
+        """Como _armar_tablas, pero rehaciendo solo las marcas/categorías que tocan los afectados."""
+        en_orden = lambda p: self.orden[p['id']]
+
+        por_vendor = dict(anterior.por_vendor)
+        marcas = {anterior.vendor_norm[p_id] for p_id in salen} | {self.vendor_norm[p_id] for p_id in entran}
+        for vendor in marcas - {""}:
+            lista = [p for p in por_vendor.get(vendor, ()) if p['id'] not in salen]
+            lista.extend(self.por_id[p_id] for p_id in entran if self.vendor_norm[p_id] == vendor)
+            if lista:
+                por_vendor[vendor] = sorted(lista, key=en_orden)
+            else:
+                por_vendor.pop(vendor, None)
+        # Orden de marcas = primera aparición en el catálogo (igual que armarlo de cero)
+        self.por_vendor = {v: por_vendor[v] for v in sorted(por_vendor, key=lambda v: en_orden(por_vendor[v][0]))}
+
+        self.por_categoria = {}
+        for cat, lista_anterior in anterior.por_categoria.items():
+            cat_norm = normalizar(cat)
+            nuevos = [
+                self.por_id[p_id] for p_id in entran
+                if cat_norm in self.category_norm[p_id] or cat_norm in self.tags_norm[p_id]
+            ]
+            sale_alguno = any(
+                cat_norm in anterior.category_norm[p_id] or cat_norm in anterior.tags_norm[p_id] for p_id in salen
+            )
+            if not nuevos and not sale_alguno:
+                self.por_categoria[cat] = lista_anterior # Intacta: se comparte entre snapshots
+                continue
+            lista = [p for p in lista_anterior if p['id'] not in salen] if sale_alguno else list(lista_anterior)
+            lista.extend(nuevos)
+            self.por_categoria[cat] = sorted(lista, key=en_orden)
+        self.rank_vendor = {v: i for i, v in enumerate(self.por_vendor)}
+
+    def _quitar_precio(self, precio: int, p_id: int) -> None:
+        desde = bisect_left(self._precios_ordenados, precio)
+        hasta = bisect_right(self._precios_ordenados, precio)
+        i = desde + self._ids_por_precio[desde:hasta].index(p_id)
+        del self._precios_ordenados[i]
+        del self._ids_por_precio[i]
+
+    def _insertar_precio(self, precio: int, p_id: int) -> None:
+        # Mismo orden que sorted((precio, id)): a igual precio, por ID
+        desde = bisect_left(self._precios_ordenados, precio)
+        hasta = bisect_right(self._precios_ordenados, precio)
+        i = desde + bisect_left(self._ids_por_precio[desde:hasta], p_id)
+        self._precios_ordenados.insert(i, precio)
+        self._ids_por_precio.insert(i, p_id)
+
+    def _armar_matcher(self) -> PhraseMatcher:
+        # Autómata único (marcas + sinónimos de categoría + frases de intención)
+        # Se recompila cuando cambian las marcas del catálogo.
+        frases = [(v, "vendor", v) for v in self.por_vendor if len(v) > 3]
+        for cat, sinonimos in self._categorias_map.items():
+            frases.extend((normalizar(s), "categoria", cat) for s in sinonimos)
+        for tipo, lista in self._intenciones_map.items():
+            frases.extend((normalizar(f), tipo, f) for f in lista)
+        return PhraseMatcher(frases)
+
+    def aplicar_delta(
+        self,
+        cambiados: List[Dict[str, Any]],
+        eliminados: Iterable[int],
+        version: int
+    ) -> "SearchIndex":
+        """
+        Snapshot siguiente = este + productos nuevos/modificados - IDs eliminados.
+        Solo se re-indexan los afectados; el resto se comparte o se copia (copy-on-write),
+        así este snapshot sigue intacto para los hilos que lo están usando.
+        El catálogo resultante queda en orden de ID (mismo orden que la carga desde SQL).
+        Deltas grandes (> MAX_FRACCION_DELTA del catálogo) se reconstruyen completos.
+        """
+        nuevos = {p['id']: p for p in cambiados}
+        salen = {p_id for p_id in eliminados if p_id in self.por_id}
+        salen.update(p_id for p_id in nuevos if p_id in self.por_id)
+
+        productos = [p for p in self.productos if p['id'] not in salen]
+        productos.extend(nuevos.values())
+        productos.sort(key=lambda p: p['id'])
+
+        if len(salen) + len(nuevos) > MAX_FRACCION_DELTA * len(self.productos):
+            return SearchIndex(productos, self._categorias_map, self._intenciones_map, version)
+
+        nuevo = SearchIndex.__new__(SearchIndex)
+        nuevo.productos = productos
+        nuevo.version = version
+        nuevo._categorias_map = self._categorias_map
+        nuevo._intenciones_map = self._intenciones_map
+        nuevo.por_id = {p['id']: p for p in productos}
+        nuevo.orden = {p['id']: pos for pos, p in enumerate(productos)}
+        nuevo.vendor_norm = dict(self.vendor_norm)
+        nuevo.category_norm = dict(self.category_norm)
+        nuevo.tags_norm = dict(self.tags_norm)
+        nuevo.stem_text = dict(self.stem_text)
+        nuevo._precio = dict(self._precio)
+        for p_id in salen:
+            nuevo._desindexar(p_id)
+        for p in nuevos.values():
+            nuevo._indexar(p)
+
+        # Posting lists: solo se rehacen las de tokens tocados
+        nuevo.postings, tocados = _parchar_postings(
+            self.postings,
+            {p_id: (self.por_id[p_id].get('search_text') or "").split() for p_id in salen},
+            {p_id: (p.get('search_text') or "").split() for p_id, p in nuevos.items()}
+        )
+        nuevo.postings_stem, _ = _parchar_postings(
+            self.postings_stem,
+            {p_id: self.stem_text[p_id].split() for p_id in salen},
+            {p_id: nuevo.stem_text[p_id].split() for p_id in nuevos}
+        )
+
+        # Vocabulario para typos: solo entran/salen las palabras que aparecieron o desaparecieron
+        nuevo._frecuencias = dict(self._frecuencias)
+        for token in tocados:
+            if token in nuevo.postings:
+                nuevo._frecuencias[token] = len(nuevo.postings[token])
+            else:
+                nuevo._frecuencias.pop(token, None)
+        agregadas = {t for t in tocados if t in nuevo.postings and t not in self.postings}
+        quitadas = {t for t in tocados if t in self.postings and t not in nuevo.postings}
+        nuevo.fuzzy = self.fuzzy.con_cambios(agregadas, quitadas, nuevo._frecuencias)
+
+        # Precios: se sacan/insertan solo los afectados (bisect), sin reordenar todo
+        nuevo._precios_ordenados = list(self._precios_ordenados)
+        nuevo._ids_por_precio = list(self._ids_por_precio)
+        for p_id in salen:
+            if p_id in self._precio:
+                nuevo._quitar_precio(self._precio[p_id], p_id)
+        for p_id in nuevos:
+            if p_id in nuevo._precio:
+                nuevo._insertar_precio(nuevo._precio[p_id], p_id)
+
+        nuevo._memo_substrings = {}
+        nuevo._vectorial = None
+        nuevo._parchar_tablas(self, salen, set(nuevos))
+        # Mismas marcas en el mismo orden: el autómata sirve tal cual
+        nuevo.matcher = self.matcher if list(nuevo.por_vendor) == list(self.por_vendor) else nuevo._armar_matcher()
+        return nuevo
+
+    def ids_con_substring(self, kw: str) -> FrozenSet[int]:
+        """
+        IDs cuyo search_text contiene `kw` (misma semántica que `kw in search_text`).
+        Como `kw` no trae espacios, basta recorrer el vocabulario, no los productos.
+        """
+        hit = self._memo_substrings.get(kw)
+        if hit is not None:
+            return hit
+
+        ids: Set[int] = set()
+        for token, token_ids in self.postings.items():
+            if kw in token:
+                ids |= token_ids
+        resultado = frozenset(ids)
+
+        if len(self._memo_substrings) >= MAX_MEMO_SUBSTRINGS:
+            self._memo_substrings = {}
+        self._memo_substrings[kw] = resultado
+        return resultado
+
+    def ids_con_frase(self, frase: str) -> List[int]:
+        """
+        IDs cuyo search_text contiene la frase literal (ej: bigrama "salvo elixir").
+        Intersecta las posting lists de cada palabra y verifica solo esos candidatos.
+        """
+        palabras = frase.split()
+        if not palabras:
+            return []
+
+        candidatos = self.ids_con_substring(palabras[0])
+        for palabra in palabras[1:]:
+            if not candidatos:
+                return []
+            candidatos = candidatos & self.ids_con_substring(palabra)
+
+        return [p_id for p_id in candidatos if frase in (self.por_id[p_id].get('search_text') or "")]
+
+    def detectar(self, texto_norm: str) -> List[Coincidencia]:
+        """Marcas, categorías e intenciones presentes en un texto ya normalizado."""
+        return self.matcher.buscar(texto_norm)
+
+    def ids_con_stem(self, token_stem: str) -> FrozenSet[int]:
+        """IDs cuyo search_stem contiene el stem como palabra completa (lookup O(1))."""
+        return self.postings_stem.get(token_stem, frozenset())
+
+    def ids_con_frase_stem(self, frase_stem: str) -> List[int]:
+        """Como ids_con_frase, pero sobre search_stem (ej: "labial rojo" encuentra "labiales rojos")."""
+        palabras = frase_stem.split()
+        if not palabras:
+            return []
+
+        candidatos = self.ids_con_stem(palabras[0])
+        for palabra in palabras[1:]:
+            if not candidatos:
+                return []
+            candidatos = candidatos & self.ids_con_stem(palabra)
+
+        return [p_id for p_id in candidatos if frase_stem in self.stem_text[p_id]]
+
+    def vectorial(self) -> VectorScorer:
+        """Scorer NumPy de este snapshot (matriz token x producto), construido la primera vez que se pide."""
+        if self._vectorial is None:
+            self._vectorial = VectorScorer(self)
+        return self._vectorial
+
+    def ordenar(self, ids) -> List[Dict[str, Any]]:
+        """Productos de `ids` en orden de catálogo."""
+        return [self.por_id[p_id] for p_id in sorted(ids, key=self.orden.__getitem__)]
+
+    def ids_en_rango(self, rango: RangoPrecio) -> Set[int]:
+        """IDs con `minimo <= int(price) <= maximo` en O(log n + k)."""
+        minimo, maximo = rango
+        desde = bisect_left(self._precios_ordenados, minimo)
+        hasta = bisect_right(self._precios_ordenados, maximo) if maximo is not None else len(self._precios_ordenados)
+        return set(self._ids_por_precio[desde:hasta])
+
+
+def _parchar_postings(
+    base: Dict[str, FrozenSet[int]],
+    quitar: Dict[int, List[str]],
+    agregar: Dict[int, List[str]]
+) -> Tuple[Dict[str, FrozenSet[int]], Set[str]]:
+    """Copia de `base` con IDs quitados/agregados por token. Retorna (postings, tokens tocados)."""
+    tocados: Dict[str, Set[int]] = {}
+    for p_id, tokens in quitar.items():
+        for token in tokens:
+            if token not in tocados: tocados[token] = set(base.get(token, ()))
+            tocados[token].discard(p_id)
+    for p_id, tokens in agregar.items():
+        for token in tokens:
+            if token not in tocados: tocados[token] = set(base.get(token, ()))
+            tocados[token].add(p_id)
+
+    postings = dict(base)
+    for token, ids in tocados.items():
+        if ids:
+            postings[token] = frozenset(ids)
+        else:
+            postings.pop(token, None)
+    return postings, set(tocados)
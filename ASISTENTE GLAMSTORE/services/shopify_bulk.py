@@ -0,0 +1,164 @@
+import json
+import time
+import logging
+import requests
+from services.http_client import http_client
+from typing import Dict, Any, Optional, Iterable, Iterator
+
+# Estados terminales de una Bulk Operation
+_ESTADOS_FIN = {"COMPLETED", "FAILED", "CANCELED", "EXPIRED"}
+
+# Límites por producto (en bulk los `first:` de conexiones anidadas no recortan la salida)
+MAX_VARIANTES = 1
+MAX_COLECCIONES = 10
+MAX_IMAGENES = 5
+
+
+class ShopifyBulkImporter:
+    """
+    Cliente de Bulk Operations de la Admin GraphQL API.
+    Lanza `bulkOperationRunQuery`, hace polling hasta que termina y entrega el
+    resultado JSONL línea a línea (stream HTTP), sin cargar el archivo en memoria.
+    """
+    def __init__(
+        self,
+        graphql_url: str,
+        headers: Dict[str, str],
+        intervalo_polling: float = 2.0,
+        timeout_total: float = 900.0
+    ) -> None:
+        self.graphql_url = graphql_url
+        self.headers = headers
+        self.intervalo_polling = intervalo_polling
+        self.timeout_total = timeout_total
+
+    def _graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        payload: Dict[str, Any] = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        try:
+            r = http_client.post(self.graphql_url, headers=self.headers, json=payload, timeout=30)
+            if r.status_code != 200:
+                logging.error(f"❌ Bulk GraphQL Error: {r.status_code} {r.text}")
+                return None
+            data = r.json()
+        except (requests.RequestException, ValueError) as e:
+            # Red caída o respuesta no-JSON: None -> quien llama usa la sync paginada
+            logging.error(f"❌ Bulk GraphQL sin respuesta válida: {e}")
+            return None
+        if "errors" in data:
+            logging.error(f"❌ Bulk GraphQL Query Errors: {data['errors']}")
+            return None
+        return data.get("data", {})
+
+    def lanzar(self, query: str) -> Optional[str]:
+        """Envía la query como Bulk Operation. Retorna el ID de la operación o None."""
+        data = self._graphql('''
+            mutation ($query: String!) {
+              bulkOperationRunQuery(query: $query) {
+                bulkOperation { id status }
+                userErrors { field message }
+              }
+            }
+        ''', {"query": query})
+        if data is None:
+            return None
+
+        resultado = data.get("bulkOperationRunQuery") or {}
+        errores = resultado.get("userErrors") or []
+        if errores:
+            # Ej: ya hay otra bulk query corriendo en la tienda (solo se permite una a la vez)
+            logging.error(f"❌ Bulk Operation rechazada: {errores}")
+            return None
+        operacion = resultado.get("bulkOperation") or {}
+        logging.info(f"📦 Bulk Operation lanzada: {operacion.get('id')} ({operacion.get('status')})")
+        return operacion.get("id")
+
+    def esperar(self, operacion_id: str) -> Optional[Dict[str, Any]]:
+        """Polling de `currentBulkOperation` hasta estado terminal. Retorna el estado final o None."""
+        limite = time.monotonic() + self.timeout_total
+        while time.monotonic() < limite:
+            data = self._graphql("{ currentBulkOperation { id status errorCode objectCount url } }")
+            if data is None:
+                return None
+
+            operacion = data.get("currentBulkOperation") or {}
+            if operacion.get("id") != operacion_id:
+                logging.error(f"❌ currentBulkOperation no corresponde a {operacion_id}: {operacion.get('id')}")
+                return None
+            if operacion.get("status") in _ESTADOS_FIN:
+                return operacion
+            time.sleep(self.intervalo_polling)
+
+        logging.error(f"❌ Bulk Operation {operacion_id} excedió {self.timeout_total}s")
+        return None
+
+    def ejecutar(self, query: str) -> Optional[Iterator[Dict[str, Any]]]:
+        """
+        Lanza + espera. Retorna un iterador de objetos JSONL (vacío si no hubo resultados)
+        o None si la operación no se pudo completar.
+        """
+        operacion_id = self.lanzar(query)
+        if not operacion_id:
+            return None
+
+        operacion = self.esperar(operacion_id)
+        if not operacion:
+            return None
+        if operacion.get("status") != "COMPLETED":
+            logging.error(f"❌ Bulk Operation terminó en {operacion.get('status')} ({operacion.get('errorCode')})")
+            return None
+
+        logging.info(f"📦 Bulk Operation completada: {operacion.get('objectCount')} objetos")
+        if not operacion.get("url"):
+            return iter(()) # Sin resultados: Shopify no genera archivo
+        return self.leer_jsonl(operacion["url"])
+
+    @staticmethod
+    def leer_jsonl(url: str) -> Iterator[Dict[str, Any]]:
+        """Descarga el JSONL en stream y entrega un objeto por línea."""
+        with http_client.get(url, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            for linea in r.iter_lines():
+                if linea:
+                    yield json.loads(linea)
+
+
+def armar_productos(lineas: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Re-arma los productos desde el JSONL plano de una Bulk Operation.
+    En el JSONL cada hijo de conexión (variante, colección, imagen) viene en su propia
+    línea con `__parentId`, siempre después de su padre. Se entrega cada producto con
+    la misma forma que un nodo de la query paginada (`variants.edges[].node`, etc.),
+    así el parser de la sync no distingue el origen. Solo hay un producto en memoria a la vez.
+    """
+    actual: Optional[Dict[str, Any]] = None
+    for obj in lineas:
+        padre = obj.pop("__parentId", None)
+        if padre is None:
+            if actual is not None:
+                yield actual
+            actual = obj
+            actual["variants"] = {"edges": []}
+            actual["collections"] = {"edges": []}
+            actual["images"] = {"edges": []}
+            continue
+
+        if actual is None or padre != actual.get("id"):
+            logging.warning(f"⚠️ Bulk JSONL: hijo {obj.get('id')} fuera de orden (padre {padre}). Ignorado.")
+            continue
+
+        tipo = (obj.get("id") or "").split("/")[3:4]
+        if tipo == ["ProductVariant"]:
+            conexion, tope = actual["variants"]["edges"], MAX_VARIANTES
+        elif tipo == ["Collection"]:
+            conexion, tope = actual["collections"]["edges"], MAX_COLECCIONES
+        elif "url" in obj:
+            conexion, tope = actual["images"]["edges"], MAX_IMAGENES
+        else:
+            continue
+        if len(conexion) < tope:
+            conexion.append({"node": obj})
+
+    if actual is not None:
+        yield actual
@@ -0,0 +1,93 @@
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+# Límites de la Admin GraphQL API
+MAX_PRIMEROS = 250 # `first:` máximo por conexión
+MAX_COSTO_QUERY = 1000 # Costo solicitado máximo de una sola query
+
+
+class ShopifyThrottle:
+    """
+    Control de costo de la Admin GraphQL API (leaky bucket por tienda).
+    Cada respuesta trae `extensions.cost`: costo solicitado/real y `throttleStatus`
+    (máximo, disponible y tasa de recuperación por segundo). Con eso:
+    - `tamano_pagina()`: la página más grande cuyo costo estimado cabe en el presupuesto.
+    - `antes_de_consultar(first)`: duerme lo justo para que el bucket alcance (no se gasta un request en THROTTLED).
+    - `registrar(data, first)`: actualiza el estado; True si la respuesta vino THROTTLED (reintentar).
+    - `esperar_reintento(intento)`: backoff para 429/5xx/errores de red.
+    """
+    def __init__(
+        self,
+        pagina_inicial: int = 50,
+        pagina_minima: int = 1,
+        max_reintentos: int = 5,
+        dormir: Callable[[float], None] = time.sleep,
+        reloj: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.pagina_inicial = pagina_inicial
+        self.pagina_minima = pagina_minima
+        self.max_reintentos = max_reintentos
+        self.dormir = dormir
+        self.reloj = reloj
+        self.costo_por_item: Optional[float] = None # Se aprende de requestedQueryCost / first
+        self.maximo: Optional[float] = None
+        self.disponible: Optional[float] = None
+        self.recuperacion: float = 50.0 # Puntos/segundo (plan estándar) hasta que Shopify diga otro
+        self._visto_en: float = 0.0
+        self.esperado_total: float = 0.0 # Segundos dormidos por costo (para logs/diagnóstico)
+
+    def tamano_pagina(self) -> int:
+        if not self.costo_por_item:
+            return self.pagina_inicial
+        presupuesto = min(MAX_COSTO_QUERY, self.maximo or MAX_COSTO_QUERY)
+        return max(self.pagina_minima, min(MAX_PRIMEROS, int(presupuesto // self.costo_por_item)))
+
+    def disponible_ahora(self) -> Optional[float]:
+        """Puntos estimados en el bucket ahora (lo último informado + lo recuperado desde entonces)."""
+        if self.disponible is None:
+            return None
+        recuperado = (self.reloj() - self._visto_en) * self.recuperacion
+        return min(self.maximo or float("inf"), self.disponible + recuperado)
+
+    def antes_de_consultar(self, first: int) -> float:
+        """Duerme si el costo estimado de la próxima query no cabe en el bucket. Retorna lo dormido."""
+        disponible = self.disponible_ahora()
+        if disponible is None or not self.costo_por_item:
+            return 0.0
+        costo = first * self.costo_por_item
+        if costo <= disponible:
+            return 0.0
+        espera = (costo - disponible) / self.recuperacion
+        logging.info(f"⏳ Shopify throttle: faltan {costo - disponible:.0f} puntos, esperando {espera:.1f}s")
+        self.dormir(espera)
+        self.esperado_total += espera
+        return espera
+
+    def registrar(self, data: Dict[str, Any], first: int) -> bool:
+        """Lee `extensions.cost` de la respuesta. Retorna True si Shopify la rechazó por THROTTLED."""
+        costo = (data.get("extensions") or {}).get("cost") or {}
+        solicitado = costo.get("requestedQueryCost")
+        if solicitado and first:
+            self.costo_por_item = solicitado / first
+        estado = costo.get("throttleStatus") or {}
+        if estado:
+            self.maximo = estado.get("maximumAvailable", self.maximo)
+            self.disponible = estado.get("currentlyAvailable", self.disponible)
+            self.recuperacion = estado.get("restoreRate") or self.recuperacion
+            self._visto_en = self.reloj()
+
+        return any(
+            (e.get("extensions") or {}).get("code") == "THROTTLED" for e in data.get("errors") or []
+        )
+
+    def esperar_reintento(self, intento: int, retry_after: Optional[str] = None) -> float:
+        """Backoff exponencial (1, 2, 4... hasta 30s) o lo que indique `Retry-After`."""
+        espera = min(30.0, 2.0 ** (intento - 1))
+        if isinstance(retry_after, str):
+            try:
+                espera = float(retry_after)
+            except ValueError:
+                pass
+        self.dormir(espera)
+        return espera
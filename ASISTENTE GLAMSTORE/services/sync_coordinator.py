@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class SyncCoordinator:
+    """
+    Single-flight para la sincronización con Shopify.
+    - Dentro del proceso: una sola sync a la vez. Quien la pide mientras corre recibe
+      el mismo Future y espera ese resultado (no lanza otra).
+    - Entre procesos (workers de gunicorn): lease en la tabla `config` con dueño y TTL,
+      tomado con BEGIN IMMEDIATE (compare-and-set atómico). El dueño lo renueva mientras
+      trabaja; si el proceso muere, el lease vence solo.
+    El worker que no obtiene el lease espera a que se libere y luego ejecuta
+    `al_esperar_remoto` (ej: recargar desde SQL lo que sincronizó el otro).
+    """
+    def __init__(
+        self,
+        conectar: Callable[[], sqlite3.Connection],
+        ttl_segundos: float = 600.0,
+        intervalo_espera: float = 2.0,
+        espera_maxima: float = 1800.0,
+        nombre: str = "sync"
+    ) -> None:
+        self._conectar = conectar
+        self.ttl_segundos = ttl_segundos
+        self.intervalo_espera = intervalo_espera
+        self.espera_maxima = espera_maxima
+        self.clave = f"lease_{nombre}"
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._en_vuelo: Optional[Future] = None
+
+    @property
+    def en_curso(self) -> bool:
+        vuelo = self._en_vuelo
+        return vuelo is not None and not vuelo.done()
+
+    def solicitar(self, tarea: Callable[[], Any], al_esperar_remoto: Optional[Callable[[], Any]] = None) -> Future:
+        """Future de la sync en curso si la hay; si no, lanza una nueva en un hilo."""
+        with self._lock:
+            if self.en_curso:
+                return self._en_vuelo
+            futuro: Future = Future()
+            self._en_vuelo = futuro
+
+        threading.Thread(
+            target=self._correr, args=(futuro, tarea, al_esperar_remoto), name=self.clave, daemon=True
+        ).start()
+        return futuro
+
+    def _correr(self, futuro: Future, tarea: Callable[[], Any], al_esperar_remoto: Optional[Callable[[], Any]]) -> None:
+        try:
+            if self._tomar_lease():
+                detener = threading.Event()
+                latido = threading.Thread(target=self._renovar_mientras, args=(detener,), daemon=True)
+                latido.start()
+                try:
+                    resultado = tarea()
+                finally:
+                    detener.set()
+                    self._soltar_lease()
+            else:
+                logging.info("⏳ Otra instancia está sincronizando: se espera su resultado.")
+                self._esperar_lease_libre()
+                resultado = al_esperar_remoto() if al_esperar_remoto else None
+            futuro.set_result(resultado)
+        except BaseException as e:
+            logging.error(f"Error en sync coordinada: {e}")
+            futuro.set_exception(e)
+
+    # --- LEASE EN SQLITE ---
+
+    def _leer_lease(self, conn: sqlite3.Connection) -> Optional[dict]:
+        row = conn.execute("SELECT value FROM config WHERE key = ?", (self.clave,)).fetchone()
+        if not row:
+            return None
+        try:
+            return json.loads(row[0])
+        except (TypeError, ValueError):
+            return None # Valor corrupto: cuenta como libre
+
+    def _tomar_lease(self, solo_si_propio: bool = False) -> bool:
+        """Toma (o renueva) el lease si está libre, vencido o ya es nuestro."""
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            lease = self._leer_lease(conn)
+            ahora = time.time()
+            propio = lease is not None and lease.get("owner") == self.owner
+            libre = lease is None or lease.get("expira", 0) <= ahora
+            if not propio and (solo_si_propio or not libre):
+                conn.rollback()
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                (self.clave, json.dumps({"owner": self.owner, "expira": ahora + self.ttl_segundos}))
+            )
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def _renovar_mientras(self, detener: threading.Event) -> None:
+        while not detener.wait(self.ttl_segundos / 3):
+            try:
+                if not self._tomar_lease(solo_si_propio=True):
+                    logging.warning("⚠️ Se perdió el lease de sync (venció y lo tomó otra instancia).")
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ No se pudo renovar el lease de sync: {e}")
+
+    def _soltar_lease(self) -> None:
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            lease = self._leer_lease(conn)
+            if lease is not None and lease.get("owner") == self.owner:
+                conn.execute("DELETE FROM config WHERE key = ?", (self.clave,))
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ No se pudo liberar el lease de sync (vencerá solo): {e}")
+        finally:
+            conn.close()
+
+    def _esperar_lease_libre(self) -> None:
+        limite = time.monotonic() + self.espera_maxima
+        while time.monotonic() < limite:
+            conn = self._conectar()
+            try:
+                lease = self._leer_lease(conn)
+            finally:
+                conn.close()
+            if lease is None or lease.get("expira", 0) <= time.time():
+                return
+            time.sleep(self.intervalo_espera)
+        logging.warning("⚠️ Se agotó la espera de la sync de otra instancia.")
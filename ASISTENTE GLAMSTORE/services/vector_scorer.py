@@ -0,0 +1,163 @@
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+
+try:
+    import numpy as np
+except ImportError: # Dependencia opcional: solo se usa con SEARCH_SCORER=numpy
+    np = None
+
+if TYPE_CHECKING:
+    from services.search_index import SearchIndex
+
+# Precio centinela para productos sin precio parseable (nunca cae en un rango)
+_SIN_PRECIO = -(2 ** 62)
+
+
+def disponible() -> bool:
+    return np is not None
+
+
+class VectorScorer:
+    """
+    Scorer vectorizado (NumPy) para la Estrategia 2 (keywords).
+    Guarda la matriz dispersa token x producto (CSR) del catálogo y calcula los
+    puntajes de TODOS los productos con operaciones de arreglo:
+      +1 por keyword (substring o mismo stem), +10 por bigrama, +5 por precio en rango.
+    Los bigramas usan una segunda matriz par-de-tokens-contiguos x producto (sin loop por candidato).
+    Mismo ranking que el scorer en Python (desempate por orden de catálogo).
+    """
+    def __init__(self, indice: "SearchIndex") -> None:
+        productos = indice.productos
+        self.n = len(productos)
+        self.ids = np.array([p['id'] for p in productos], dtype=np.int64)
+        pos = {p['id']: i for i, p in enumerate(productos)}
+
+
+        precios = []
+        for p in productos:
+            try:
+                precios.append(int(p['price']))
+            except (KeyError, TypeError, ValueError):
+                precios.append(_SIN_PRECIO)
+        self.precios = np.array(precios, dtype=np.int64)
+
+        # Tokens (substring sobre el vocabulario): fila de cada no-cero + columna (producto)
+        vocab = list(indice.postings)
+        self.vocab = np.array(vocab, dtype=str)
+        self.fila_nnz, self.col_nnz = self._coo(vocab, indice.postings, pos)
+
+        # Stems (match exacto): CSR con acceso directo por fila
+        self.fila_stem: Dict[str, int] = {s: i for i, s in enumerate(indice.postings_stem)}
+        filas_stem, self.col_stem = self._coo(list(indice.postings_stem), indice.postings_stem, pos)
+        self.indptr_stem = np.searchsorted(filas_stem, np.arange(len(self.fila_stem) + 1))
+
+        # Bigramas: "a b" está en el texto <=> hay tokens contiguos (izq, der) con izq que termina en `a`
+        # y der que empieza con `b` (las keywords no traen espacios). Se separa por " " igual que el `in`.
+        self.pares = self._pares([p.get('search_text') or "" for p in productos])
+        self.pares_stem = self._pares([indice.stem_text[p['id']] for p in productos])
+
+    @staticmethod
+    def _coo(claves: List[str], postings, pos: Dict[int, int]) -> Tuple[Any, Any]:
+        filas: List[int] = []
+        cols: List[int] = []
+        for r, clave in enumerate(claves):
+            ids = postings[clave]
+            filas.extend([r] * len(ids))
+            cols.extend(pos[p_id] for p_id in ids)
+        return np.array(filas, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+    @staticmethod
+    def _pares(textos: List[str]) -> Tuple[Any, Any, Any, Any, Any]:
+        """
+        Vocabulario de tokens + pares contiguos como índices a ese vocabulario (izq, der)
+        + no-ceros (fila de par, columna de producto).
+        """
+        token_de: Dict[str, int] = {}
+        fila_de: Dict[Tuple[int, int], int] = {}
+        filas: List[int] = []
+        cols: List[int] = []
+        for c, texto in enumerate(textos):
+            tokens = [token_de.setdefault(t, len(token_de)) for t in texto.split(" ")]
+            for par in set(zip(tokens, tokens[1:])):
+                filas.append(fila_de.setdefault(par, len(fila_de)))
+                cols.append(c)
+        izq = np.array([a for a, _ in fila_de], dtype=np.int64)
+        der = np.array([b for _, b in fila_de], dtype=np.int64)
+        return (np.array(list(token_de), dtype=str), izq, der,
+                np.array(filas, dtype=np.int64), np.array(cols, dtype=np.int64))
+
+    def _hits_bigrama(self, pares: Tuple[Any, Any, Any, Any, Any], a: str, b: str):
+        """
+        Productos que contienen la frase "a b": el match de texto se hace sobre el vocabulario de tokens
+        (chico), los pares se resuelven con índices enteros y se proyectan a columnas.
+        """
+        tokens, izq, der, fila_nnz, col_nnz = pares
+        hit = np.zeros(self.n, dtype=bool)
+        if len(izq):
+            filas = np.char.endswith(tokens, a)[izq] & np.char.startswith(tokens, b)[der]
+            hit[col_nnz[filas[fila_nnz]]] = True
+        return hit
+
+    def _hits_substring(self, kw: str):
+        """Productos cuyo search_text contiene kw: substring sobre el vocabulario y proyección a columnas."""
+        filas = np.char.find(self.vocab, kw) >= 0 if len(self.vocab) else np.zeros(0, dtype=bool)
+        hit = np.zeros(self.n, dtype=bool)
+        hit[self.col_nnz[filas[self.fila_nnz]]] = True
+        return hit
+
+    def _hits_stem(self, token_stem: str):
+        hit = np.zeros(self.n, dtype=bool)
+        r = self.fila_stem.get(token_stem)
+        if r is not None:
+            hit[self.col_stem[self.indptr_stem[r]:self.indptr_stem[r + 1]]] = True
+        return hit
+
+    def top(
+        self,
+        keywords: List[str],
+        stems: List[str],
+        rango_precio: Optional[Tuple[int, Optional[int]]],
+        k: int = 5
+    ) -> List[int]:
+        """IDs del top-k (score desc, orden de catálogo asc)."""
+        if not self.n:
+            return []
+
+        scores = np.zeros(self.n, dtype=np.int64)
+        hits_sub = [self._hits_substring(kw) for kw in keywords]
+        hits_stem = [self._hits_stem(s) for s in stems]
+
+        # 1. Keywords: +1 por keyword (substring o stem, sin contar doble)
+        for h_sub, h_stem in zip(hits_sub, hits_stem):
+            scores += h_sub | h_stem
+
+        # 2. Bigramas: frase literal (search_text) o frase de stems cuyas dos palabras son stems del producto
+        for i in range(len(keywords) - 1):
+            bigrama = self._hits_bigrama(self.pares, keywords[i], keywords[i + 1])
+            bigrama |= (self._hits_bigrama(self.pares_stem, stems[i], stems[i + 1])
+                        & hits_stem[i] & hits_stem[i + 1])
+            scores += 10 * bigrama
+
+        # 3. Precio: +5 en rango y filtro estricto si hay candidatos en rango
+        candidatos = scores > 0
+        if rango_precio:
+            minimo, maximo = rango_precio
+            en_rango = self.precios >= minimo
+            if maximo is not None:
+                en_rango &= self.precios <= maximo
+            scores += 5 * en_rango
+            candidatos = scores > 0
+            filtrados = candidatos & en_rango
+            if filtrados.any():
+                candidatos = filtrados
+
+        idx = np.flatnonzero(candidatos)
+        if not len(idx):
+            return []
+
+        # Clave compuesta: score desc y, a igual score, posición asc
+        clave = scores[idx] * self.n + (self.n - 1 - idx)
+        if len(idx) > k:
+            parte = np.argpartition(-clave, k)[:k]
+            idx, clave = idx[parte], clave[parte]
+        orden = np.argsort(-clave)
+        return [int(p_id) for p_id in self.ids[idx[orden]]]
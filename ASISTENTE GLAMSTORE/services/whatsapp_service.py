@@ -1,9 +1,9 @@
 import os
-import requests
 import logging
 import json
 import time
 from typing import Optional, Dict, Any, Union
+from services.http_client import http_client
 
 # Configuración de Logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -66,7 +66,7 @@ def enviar_whatsapp(numero: str, texto: str, url_media: Optional[str] = None) ->
         else:
             payload["text"] = {"body": texto}
             
-        r = requests.post(url, headers=headers, json=payload)
+        r = http_client.post(url, headers=headers, json=payload)
         
         if r.status_code in [200, 201]:
             logging.info(f"📤 Respuesta enviada a {numero}")
@@ -89,7 +89,7 @@ def descargar_media_meta(media_id: str) -> Optional[bytes]:
         headers = {"Authorization": f"Bearer {TOKEN_WHATSAPP}"}
         
         # 1. Obtener URL de descarga
-        r = requests.get(url_info, headers=headers)
+        r = http_client.get(url_info, headers=headers)
         if r.status_code != 200:
             logging.error(f"Error obteniendo URL media: {r.text}")
             return None
@@ -97,7 +97,7 @@ def descargar_media_meta(media_id: str) -> Optional[bytes]:
         media_url = r.json().get("url")
         
         # 2. Descargar binario
-        r_bin = requests.get(media_url, headers=headers)
+        r_bin = http_client.get(media_url, headers=headers, timeout=(5, 60)) # Audios/fotos pueden pesar
         if r_bin.status_code == 200:
             return r_bin.content
         return None
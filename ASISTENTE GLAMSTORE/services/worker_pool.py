@@ -0,0 +1,204 @@
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+class BoundedWorkerPool:
+    """
+    Pool fijo de hilos con cola acotada (backpressure).
+    `enviar()` nunca bloquea: si la cola está llena retorna False y quien llama decide
+    cómo descargar la carga (ej: responder "estamos ocupados").
+    Así una ráfaga no crea hilos sin límite y la latencia queda acotada por
+    `max_cola / workers` tareas por delante.
+    """
+    def __init__(self, workers: int = 4, max_cola: int = 32, nombre: str = "pool", muestras_espera: int = 200) -> None:
+        self.workers = max(1, workers)
+        self.max_cola = max(1, max_cola)
+        self.nombre = nombre
+        self._cola: "queue.Queue" = queue.Queue(maxsize=self.max_cola)
+        self._hilos: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._esperas: deque = deque(maxlen=muestras_espera) # Segundos en cola de las últimas tareas
+        self.en_proceso = 0
+        self.procesadas = 0
+        self.rechazadas = 0
+        self.fallidas = 0
+
+    def _iniciar(self) -> None:
+        with self._lock:
+            while len(self._hilos) < self.workers:
+                hilo = threading.Thread(target=self._trabajar, name=f"{self.nombre}-{len(self._hilos)}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+    def enviar(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        """Encola la tarea. False si la cola está llena (la tarea NO se ejecutará)."""
+        if len(self._hilos) < self.workers:
+            self._iniciar()
+        try:
+            self._cola.put_nowait((time.monotonic(), fn, args, kwargs))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rechazadas += 1
+            return False
+
+    def _trabajar(self) -> None:
+        while True:
+            tarea = self._cola.get()
+            if tarea is None: # Señal de detener
+                return
+            encolada, fn, args, kwargs = tarea
+            with self._lock:
+                self._esperas.append(time.monotonic() - encolada)
+                self.en_proceso += 1
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.fallidas += 1
+                logging.error(f"🔥 Error en tarea de {self.nombre}: {e}")
+            finally:
+                with self._lock:
+                    self.en_proceso -= 1
+                    self.procesadas += 1
+                self._cola.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidad de cola y tiempos de espera (ms) de las últimas tareas."""
+        with self._lock:
+            esperas = sorted(self._esperas)
+            datos: Dict[str, Any] = {
+                "workers": self.workers,
+                "en_cola": self._cola.qsize(),
+                "max_cola": self.max_cola,
+                "en_proceso": self.en_proceso,
+                "procesadas": self.procesadas,
+                "rechazadas": self.rechazadas,
+                "fallidas": self.fallidas,
+            }
+        for clave, q in (("espera_p50_ms", 0.5), ("espera_p95_ms", 0.95), ("espera_max_ms", 1.0)):
+            datos[clave] = round(esperas[min(len(esperas) - 1, int(len(esperas) * q))] * 1000, 1) if esperas else 0.0
+        return datos
+
+    def detener(self, timeout: Optional[float] = None) -> None:
+        """Termina los hilos después de vaciar lo ya encolado."""
+        with self._lock:
+            hilos, self._hilos = self._hilos, []
+        for _ in hilos:
+            self._cola.put(None)
+        for hilo in hilos:
+            hilo.join(timeout)
+
+
+class KeyedDispatcher:
+    """
+    Carriles por clave (ej: número de WhatsApp) sobre un BoundedWorkerPool.
+    - Lo de una misma clave se procesa de a uno y en orden de llegada (un solo drenado activo por carril).
+    - Claves distintas corren en paralelo, hasta los workers del pool.
+    - `combinar(lote) -> lista`: opcional; fusiona una ráfaga ya encolada de la misma clave
+      (ej: tres mensajes seguidos -> una sola llamada al LLM). `ventana` segundos de espera
+      antes de drenar para juntar la ráfaga (ocupa un worker mientras espera).
+    """
+    def __init__(
+        self,
+        pool: BoundedWorkerPool,
+        procesar: Callable[[Any, Any], None],
+        combinar: Optional[Callable[[List[Any]], List[Any]]] = None,
+        ventana: float = 0.0,
+        max_por_carril: int = 10
+    ) -> None:
+        self.pool = pool
+        self.procesar = procesar
+        self.combinar = combinar
+        self.ventana = ventana
+        self.max_por_carril = max_por_carril
+        self._carriles: Dict[Any, deque] = {}
+        self._lock = threading.Lock()
+        self.combinados = 0 # Items que se fusionaron con otros
+        self.rechazados = 0
+
+    def enviar(self, clave: Any, item: Any) -> bool:
+        """Encola `item` en el carril de `clave`. False si no hay cupo (carril o pool lleno)."""
+        with self._lock:
+            carril = self._carriles.get(clave)
+            if carril is not None: # Ya hay un drenado en curso para esta clave: se suma en orden
+                if len(carril) >= self.max_por_carril:
+                    self.rechazados += 1
+                    return False
+                carril.append(item)
+                return True
+            # El carril se crea y se encola su drenado bajo el mismo lock (pool.enviar no bloquea):
+            # nadie puede sumarse a un carril que el pool termine rechazando.
+            if not self.pool.enviar(self._drenar, clave):
+                self.rechazados += 1
+                return False
+            self._carriles[clave] = deque([item])
+            return True
+
+    def _drenar(self, clave: Any) -> None:
+        if self.combinar and self.ventana > 0:
+            time.sleep(self.ventana)
+        while True:
+            with self._lock:
+                carril = self._carriles[clave]
+                if not carril:
+                    del self._carriles[clave]
+                    return
+                if self.combinar and len(carril) > 1:
+                    lote = list(carril)
+                    carril.clear()
+                else:
+                    lote = [carril.popleft()]
+
+            items = lote
+            if len(lote) > 1:
+                try:
+                    items = self.combinar(lote)
+                except Exception as e:
+                    logging.error(f"🔥 Error combinando ráfaga de {clave}: {e}")
+            self.combinados += len(lote) - len(items)
+            for item in items:
+                try:
+                    self.procesar(clave, item)
+                except Exception as e:
+                    logging.error(f"🔥 Error procesando carril {clave}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "carriles_activos": len(self._carriles),
+                "en_carriles": sum(len(c) for c in self._carriles.values()),
+                "combinados": self.combinados,
+                "rechazados_carril": self.rechazados,
+            }
+
+
+class LimitadorPorClave:
+    """
+    A lo más un evento por clave cada `ventana` segundos (ej: un aviso de "ocupados" por número).
+    `permitir(clave)` registra el evento y retorna True, o False si la clave ya tuvo uno dentro de la ventana.
+    Las claves vencidas se purgan al superar `max_claves`, así la memoria queda acotada.
+    """
+    def __init__(self, ventana: float = 60.0, max_claves: int = 10000, reloj: Callable[[], float] = time.monotonic) -> None:
+        self.ventana = ventana
+        self.max_claves = max_claves
+        self.reloj = reloj
+        self._ultimo: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+        self.suprimidos = 0
+
+    def permitir(self, clave: Any) -> bool:
+        ahora = self.reloj()
+        with self._lock:
+            ultimo = self._ultimo.get(clave)
+            if ultimo is not None and ahora - ultimo < self.ventana:
+                self.suprimidos += 1
+                return False
+            if len(self._ultimo) >= self.max_claves:
+                self._ultimo = {c: t for c, t in self._ultimo.items() if ahora - t < self.ventana}
+            self._ultimo[clave] = ahora
+            return True
@@ -0,0 +1,153 @@
+"""
+Servidor local que imita la Admin GraphQL API de Shopify para Bulk Operations.
+Sirve una salida JSONL enlatada, para probar la importación bulk sin conexión.
+
+Uso manual:
+    python shopify_bulk_stub.py [puerto] [archivo.jsonl]
+    SHOPIFY_URL=http://127.0.0.1:<puerto> SHOPIFY_TOKEN=x python app.py
+"""
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+
+# Salida enlatada: 2 productos con sus hijos (variante, colección, imágenes) en líneas aparte
+JSONL_EJEMPLO: List[Dict[str, Any]] = [
+    {"id": "gid://shopify/Product/1001", "title": "Maison Alhambra Salvo Elixir", "descriptionHtml": "<p>EDP 100ml</p>",
+     "vendor": "Maison Alhambra", "productType": "Perfume", "handle": "salvo-elixir", "tags": ["Perfume", "Hombre"],
+     "status": "ACTIVE", "publishedAt": "2024-05-01T10:00:00Z", "updatedAt": "2024-05-01T10:00:00Z",
+     "category": {"name": "Perfumes"}},
+    {"id": "gid://shopify/ProductVariant/2001", "price": "29990.00", "compareAtPrice": "34990.00",
+     "inventoryQuantity": 4, "inventoryPolicy": "DENY", "__parentId": "gid://shopify/Product/1001"},
+    {"id": "gid://shopify/Collection/3001", "title": "Árabes", "__parentId": "gid://shopify/Product/1001"},
+    {"id": "gid://shopify/ProductImage/4001", "url": "https://cdn.example.com/salvo.jpg", "__parentId": "gid://shopify/Product/1001"},
+    {"id": "gid://shopify/Product/1002", "title": "Lattafa Yara", "descriptionHtml": "",
+     "vendor": "Lattafa", "productType": "Perfume", "handle": "yara", "tags": [],
+     "status": "ACTIVE", "publishedAt": "2024-05-02T10:00:00Z", "updatedAt": "2024-05-02T12:30:00Z",
+     "category": None},
+    {"id": "gid://shopify/ProductVariant/2002", "price": "24990.00", "compareAtPrice": None,
+     "inventoryQuantity": 10, "inventoryPolicy": "DENY", "__parentId": "gid://shopify/Product/1002"},
+]
+
+
+class ShopifyBulkStub:
+    """
+    Servidor HTTP en un hilo (puerto libre por defecto).
+    - POST /admin/api/<v>/graphql.json: bulkOperationRunQuery y currentBulkOperation.
+    - GET /bulk.jsonl: la salida enlatada, una línea por objeto.
+    `polls_en_curso`: cuántos polls responden RUNNING antes de COMPLETED.
+    """
+    def __init__(
+        self,
+        lineas: Optional[List[Dict[str, Any]]] = None,
+        polls_en_curso: int = 1,
+        estado_final: str = "COMPLETED",
+        puerto: int = 0
+    ) -> None:
+        self.lineas = JSONL_EJEMPLO if lineas is None else lineas
+        self.polls_en_curso = polls_en_curso
+        self.estado_final = estado_final
+        self.queries: List[str] = [] # Queries recibidas (para inspección en tests)
+        self._polls = 0
+        self._operacion: Optional[str] = None
+        self._server = ThreadingHTTPServer(("127.0.0.1", puerto), self._handler())
+        self._hilo: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, puerto = self._server.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    @property
+    def graphql_url(self) -> str:
+        return f"{self.base_url}/admin/api/2024-10/graphql.json"
+
+    def _responder_graphql(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        query = payload.get("query", "")
+        if "bulkOperationRunQuery" in query:
+            self.queries.append((payload.get("variables") or {}).get("query", ""))
+            if self._operacion and self._polls <= self.polls_en_curso:
+                return {"data": {"bulkOperationRunQuery": {"bulkOperation": None, "userErrors": [
+                    {"field": None, "message": "A bulk query operation for this app and shop is already in progress"}
+                ]}}}
+            self._operacion = f"gid://shopify/BulkOperation/{len(self.queries)}"
+            self._polls = 0
+            return {"data": {"bulkOperationRunQuery": {
+                "bulkOperation": {"id": self._operacion, "status": "CREATED"}, "userErrors": []
+            }}}
+
+        if "currentBulkOperation" in query:
+            self._polls += 1
+            terminado = self._polls > self.polls_en_curso
+            operacion = {
+                "id": self._operacion,
+                "status": self.estado_final if terminado else "RUNNING",
+                "errorCode": None if self.estado_final == "COMPLETED" else "INTERNAL_SERVER_ERROR",
+                "objectCount": str(len(self.lineas)) if terminado else "0",
+                "url": f"{self.base_url}/bulk.jsonl" if terminado and self.lineas and self.estado_final == "COMPLETED" else None,
+            }
+            return {"data": {"currentBulkOperation": operacion}}
+
+        return {"errors": [{"message": "Query no soportada por el stub"}]}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, como la API real
+
+            def _enviar(self, codigo: int, cuerpo: bytes, tipo: str) -> None:
+                self.send_response(codigo)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_POST(self):
+                if not self.path.endswith("/graphql.json"):
+                    return self._enviar(404, b"{}", "application/json")
+                largo = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(largo) or b"{}")
+                cuerpo = json.dumps(stub._responder_graphql(payload)).encode()
+                self._enviar(200, cuerpo, "application/json")
+
+            def do_GET(self):
+                if self.path != "/bulk.jsonl":
+                    return self._enviar(404, b"", "text/plain")
+                cuerpo = "".join(json.dumps(obj) + "\n" for obj in stub.lineas).encode()
+                self._enviar(200, cuerpo, "application/jsonl")
+
+            def log_message(self, *args):
+                pass # Silencioso (los tests no necesitan el access log)
+
+        return Handler
+
+    def iniciar(self) -> "ShopifyBulkStub":
+        self._hilo = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "ShopifyBulkStub":
+        return self.iniciar()
+
+    def __exit__(self, *exc) -> None:
+        self.detener()
+
+
+if __name__ == "__main__":
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    lineas = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding="utf-8") as f:
+            lineas = [json.loads(l) for l in f if l.strip()]
+    stub = ShopifyBulkStub(lineas, puerto=puerto).iniciar()
+    print(f"🧪 Stub Bulk Operations en {stub.graphql_url} (Ctrl+C para salir)")
+    try:
+        stub._hilo.join()
+    except KeyboardInterrupt:
+        stub.detener()
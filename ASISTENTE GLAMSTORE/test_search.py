@@ -1,11 +1,36 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 import logging
+import os
+import tempfile
+import time
 from database import GlamStoreDB
+from services.search_index import SearchIndex, extraer_rango_precio, stem
+from services.phrase_matcher import PhraseMatcher
+from services.query_cache import QueryCache
+from services.fuzzy_index import TrigramIndex, distancia_edicion
+from services import vector_scorer
+from services.shopify_bulk import ShopifyBulkImporter, armar_productos
+from shopify_bulk_stub import ShopifyBulkStub
+from services.pipeline import prefetch
+from services.sync_coordinator import SyncCoordinator
+from services.shopify_throttle import ShopifyThrottle
+from services.http_client import HttpClient
+from services.worker_pool import BoundedWorkerPool, KeyedDispatcher, LimitadorPorClave
+import threading
+import subprocess
+import requests
+import sys
 
 # Configurar logging para ver lo que pasa
 logging.basicConfig(level=logging.INFO)
 
+def db_temporal(test: unittest.TestCase) -> GlamStoreDB:
+    """GlamStoreDB sobre un archivo temporal: los tests no migran ni reescriben el glamstore.db versionado."""
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+    return GlamStoreDB(os.path.join(tmpdir.name, "test.db"))
+
 class TestGlamStoreLogic(unittest.TestCase):
     def setUp(self):
         self.db = GlamStoreDB()
@@ -30,8 +55,7 @@ class TestGlamStoreLogic(unittest.TestCase):
             "variant_id": 222
         }
         
-        self.db.productos = [p1, p2]
-        self.db.total_items = 2
+        self.db.productos = [p1, p2] # Reconstruye el índice (total_items se deriva de aquí)
         logging.info(f"DB Cargada con: {[p['title'] for p in self.db.productos]}")
 
     def test_busqueda_perfume(self):
@@ -117,5 +141,928 @@ class TestGlamStoreLogic(unittest.TestCase):
         print(f"Busqueda Foto 3 ('{query3}'): {res3['tipo']}")
         self.assertNotEqual(res3['tipo'], "VACIO")
 
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.indice = SearchIndex([
+            {'id': 1, 'price': 15000, 'search_text': "maison alhambra salvo elixir edp"},
+            {'id': 2, 'price': 12000, 'search_text': "salvo  elixir desodorante"},
+            {'id': 3, 'price': 15000, 'search_text': "lattafa mayar spray"},
+        ])
+
+    def test_substring_igual_que_in(self):
+        # Misma semántica que `kw in search_text` (substring, no token exacto)
+        self.assertEqual(self.indice.ids_con_substring("alhambr"), {1})
+        self.assertEqual(self.indice.ids_con_substring("elixir"), {1, 2})
+        self.assertEqual(self.indice.ids_con_substring("pan"), set())
+
+    def test_frase_exige_palabras_contiguas(self):
+        # El producto 2 tiene doble espacio: "salvo elixir" no es substring literal
+        self.assertEqual(self.indice.ids_con_frase("salvo elixir"), [1])
+
+    def test_rango_precio(self):
+        self.assertEqual(self.indice.ids_en_rango((15000, 15000)), {1, 3})
+        self.assertEqual(self.indice.ids_en_rango((0, 12000)), {2})
+        self.assertEqual(self.indice.ids_en_rango((13000, None)), {1, 3})
+        self.assertEqual(self.indice.ids_en_rango((1, 999)), set())
+
+
+class TestExtraccionPrecio(unittest.TestCase):
+    def test_frases_de_rango(self):
+        self.assertEqual(extraer_rango_precio("perfumes de 3000"), (3000, 3000))
+        self.assertEqual(extraer_rango_precio("uno de $12.990"), (12990, 12990))
+        self.assertEqual(extraer_rango_precio("menos de 10000"), (0, 10000))
+        self.assertEqual(extraer_rango_precio("hasta 10 mil"), (0, 10000))
+        self.assertEqual(extraer_rango_precio("entre 5 y 15 mil"), (5000, 15000))
+        self.assertEqual(extraer_rango_precio("desde 20 mil"), (20000, None))
+        # Medidas no son precios
+        self.assertIsNone(extraer_rango_precio("spray 200 ml"))
+        self.assertIsNone(extraer_rango_precio("edp 30ml"))
+
+    def test_medidas_y_decimales(self):
+        # Tamaños pegados o separados de la unidad no son filtros de precio
+        for consulta in ("shampoo 1000ml", "perfume 1500ml", "500 ml", "shampoo 1000 ml", "hasta 500 ml"):
+            self.assertIsNone(extraer_rango_precio(consulta), consulta)
+        self.assertEqual(extraer_rango_precio("perfume 100ml de 20 mil"), (20000, 20000))
+        # Coma decimal y de miles
+        self.assertEqual(extraer_rango_precio("1,5 mil"), (1500, 1500))
+        self.assertEqual(extraer_rango_precio("hasta 1,5 mil"), (0, 1500))
+        self.assertEqual(extraer_rango_precio("uno de 12,990"), (12990, 12990))
+        self.assertEqual(extraer_rango_precio("algo de 15k"), (15000, 15000))
+
+    def test_busqueda_con_rango(self):
+        db = db_temporal(self)
+        db.productos = [
+            {'id': 1, 'title': "Perfume A", 'price': 8000, 'category': "Perfumes", 'search_text': "perfume a"},
+            {'id': 2, 'title': "Perfume B", 'price': 25000, 'category': "Perfumes", 'search_text': "perfume b"},
+            {'id': 3, 'title': "Crema C", 'price': 9000, 'category': "Skin Care", 'search_text': "crema c"},
+        ]
+        res = db.buscar_contextual("perfumes menos de 10 mil")
+        self.assertEqual([p['id'] for p in res['items']], [1])
+        # Solo precio (sin categoría ni keywords)
+        res = db.buscar_contextual("algo entre 5 y 9 mil")
+        self.assertEqual(sorted(p['id'] for p in res['items']), [1, 3])
+
+class TestTablasVendorCategoria(unittest.TestCase):
+    def test_tablas_precalculadas(self):
+        indice = SearchIndex([
+            {'id': 1, 'price': 1, 'vendor': "Maison Alhambra", 'category': "Perfumes", 'tags': "Árabe, Oferta", 'search_text': "a"},
+            {'id': 2, 'price': 1, 'vendor': "LATTAFA", 'category': "Desodorantes", 'tags': "Perfumes", 'search_text': "b"},
+            {'id': 3, 'price': 1, 'vendor': "Maison Alhambra", 'category': "Skin Care", 'tags': "", 'search_text': "c"},
+        ], {"Perfumes": ["perfume"], "Skin Care": ["crema"]})
+
+        self.assertEqual([p['id'] for p in indice.por_vendor["maison alhambra"]], [1, 3])
+        self.assertEqual(indice.tags_norm[1], "arabe  oferta")
+        # Match por categoría o por tags, en orden de catálogo
+        self.assertEqual([p['id'] for p in indice.por_categoria["Perfumes"]], [1, 2])
+        self.assertEqual([p['id'] for p in indice.por_categoria["Skin Care"]], [3])
+
+class TestPhraseMatcher(unittest.TestCase):
+    def test_coincidencias_tipadas_una_pasada(self):
+        matcher = PhraseMatcher([
+            ("maison alhambra", "vendor", "maison alhambra"),
+            ("perfume", "categoria", "Perfumes"),
+            ("donde", "soporte", "donde"),
+            ("link", "cierre", "link"),
+            ("link de pago", "compra", "link de pago"),
+        ])
+        res = matcher.buscar("donde compro el perfume maison alhambra? link de pago")
+        tipos = {(c.tipo, c.valor) for c in res}
+        self.assertEqual(tipos, {
+            ("soporte", "donde"), ("categoria", "Perfumes"), ("vendor", "maison alhambra"),
+            ("cierre", "link"), ("compra", "link de pago"),
+        })
+        # Semántica de substring, igual que `frase in texto`
+        self.assertEqual([c.tipo for c in matcher.buscar("perfumes")], ["categoria"])
+        self.assertEqual(matcher.buscar("nada"), [])
+
+class TestBusquedaFTS(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = GlamStoreDB(os.path.join(self.tmpdir.name, "test.db"))
+        if not self.db.fts_disponible:
+            self.skipTest("SQLite sin FTS5")
+
+        conn = self.db._get_conn()
+        for p_id, titulo, precio in [
+            (1, "Maison Alhambra Salvo Elixir Edp", 29990),
+            (2, "Lattafa Mayar Desodorante Spray", 12000),
+            (3, "Salvo Intense Edp", 15000),
+        ]:
+            conn.execute(
+                "INSERT INTO productos (id, title, price, search_text) VALUES (?, ?, ?, ?)",
+                (p_id, titulo, precio, self.db._normalizar(titulo))
+            )
+        conn.commit() # productos_fts se mantiene solo (triggers)
+        conn.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bm25_prioriza_frase(self):
+        res = self.db.buscar_contextual("tienen salvo elixir?", engine="fts")
+        self.assertEqual(res['tipo'], "EXACTO")
+        self.assertEqual(res['items'][0]['id'], 1)
+        self.assertEqual({p['id'] for p in res['items']}, {1, 3})
+
+    def test_filtro_precio(self):
+        res = self.db.buscar_contextual("salvo 15000", engine="fts")
+        self.assertEqual([p['id'] for p in res['items']], [3])
+
+    def test_sin_resultados(self):
+        self.assertEqual(self.db.buscar_contextual("pan", engine="fts")['tipo'], "VACIO")
+
+class TestTopKYSemilla(unittest.TestCase):
+    def setUp(self):
+        self.db = db_temporal(self)
+        self.db.productos = [
+            {'id': i, 'title': f"Perfume {i}", 'price': 10000, 'category': "Perfumes", 'search_text': f"perfume edp {i}"}
+            for i in range(50)
+        ]
+
+    def test_muestreo_con_semilla_es_reproducible(self):
+        a = self.db.buscar_contextual("perfumes", seed="56911111111:perfumes")
+        b = self.db.buscar_contextual("perfumes", seed="56911111111:perfumes")
+        self.assertEqual([p['id'] for p in a['items']], [p['id'] for p in b['items']])
+        self.assertEqual(len(a['items']), 5)
+
+    def test_top_k_desempata_por_orden_de_catalogo(self):
+        # Todos empatan en score: deben salir los 5 primeros del catálogo
+        res = self.db.buscar_contextual("edp")
+        self.assertEqual([p['id'] for p in res['items']], [0, 1, 2, 3, 4])
+
+class TestIndiceDelta(unittest.TestCase):
+    def test_delta_equivale_a_reconstruir(self):
+        base = [
+            {'id': i, 'title': f"Producto {i}", 'vendor': "Lattafa" if i % 2 else "Armaf", 'price': 1000 * i,
+             'category': "Perfumes", 'search_text': f"producto {i} {'lattafa' if i % 2 else 'armaf'} edp"}
+            for i in range(1, 31)
+        ]
+        indice = SearchIndex(base, {"Perfumes": ["perfume"]}, version=1)
+        cambiados = [
+            {'id': 4, 'title': "Rasasi Hawas", 'vendor': "Rasasi", 'price': 2500, 'search_text': "rasasi hawas edp"},
+            {'id': 40, 'title': "Yara", 'vendor': "Lattafa", 'price': 9000, 'search_text': "yara lattafa"},
+        ]
+        delta = indice.aplicar_delta(cambiados, [7, 8], version=2)
+
+        esperado = {p['id']: p for p in base if p['id'] not in (4, 7, 8)}
+        esperado.update({p['id']: p for p in cambiados})
+        completo = SearchIndex(sorted(esperado.values(), key=lambda p: p['id']), {"Perfumes": ["perfume"]}, version=2)
+        for campo in ("orden", "postings", "postings_stem", "por_vendor", "por_categoria", "rank_vendor", "_ids_por_precio"):
+            self.assertEqual(getattr(delta, campo), getattr(completo, campo), campo)
+        self.assertEqual(delta.fuzzy.corregir("hawaz"), "hawas")  # Palabra nueva entra al vocabulario de typos
+        self.assertEqual([c.valor for c in delta.detectar("rasasi")], ["rasasi"])  # Marca nueva en el autómata
+        self.assertNotIn("producto 7", [p['search_text'] for p in delta.productos])
+        self.assertEqual(len(indice.productos), 30)  # El snapshot anterior queda intacto
+
+class TestCacheBusquedas(unittest.TestCase):
+    def test_lru_y_version(self):
+        cache = QueryCache(max_items=2, ttl_seconds=60)
+        cache.put("a", 1, version=1)
+        cache.put("b", 2, version=1)
+        self.assertEqual(cache.get("a", 1), 1)
+        cache.put("c", 3, version=1) # Expulsa "b" (menos usado)
+        self.assertIsNone(cache.get("b", 1))
+        self.assertIsNone(cache.get("a", 2)) # Catálogo nuevo -> miss
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_recarga_de_catalogo_invalida(self):
+        db = db_temporal(self)
+        db.productos = [{'id': 1, 'title': "Salvo", 'price': 1000, 'search_text': "salvo edp"}]
+        db.buscar_contextual("salvo")
+        db.buscar_contextual("Salvo?")  # Misma consulta normalizada -> hit
+        self.assertEqual(db.cache_stats()['hits'], 1)
+
+        db.productos = [{'id': 2, 'title': "Salvo Elixir", 'price': 1000, 'search_text': "salvo elixir"}]
+        res = db.buscar_contextual("salvo")
+        self.assertEqual([p['id'] for p in res['items']], [2])
+        self.assertEqual(db.get_status()['cache_busquedas']['misses'], 2)
+
+    def test_clave_incluye_el_precio_del_texto_crudo(self):
+        # "1,5 mil" y "1 5 mil" normalizan igual pero su precio es distinto: no comparten entrada
+        db = db_temporal(self)
+        db.productos = [
+            {'id': 1, 'title': "Perfume A", 'price': 1500, 'search_text': "perfume a"},
+            {'id': 2, 'title': "Perfume B", 'price': 5000, 'search_text': "perfume b"},
+            {'id': 3, 'title': "Perfume C", 'price': 12990, 'search_text': "perfume c"},
+        ]
+        self.assertEqual([p['id'] for p in db.buscar_contextual("perfume 1,5 mil")['items']], [1])
+        self.assertEqual([p['id'] for p in db.buscar_contextual("perfume 1 5 mil")['items']], [2])
+        self.assertEqual([p['id'] for p in db.buscar_contextual("perfume 12,990")['items']], [3])
+        self.assertEqual(sorted(p['id'] for p in db.buscar_contextual("perfume 12 990")['items']), [1, 2, 3])
+        self.assertEqual(db.cache_stats()['hits'], 0)
+
+class TestStemming(unittest.TestCase):
+    def test_plurales(self):
+        self.assertEqual(stem("shampoos"), "shampoo")
+        self.assertEqual(stem("alhambras"), "alhambra")
+        self.assertEqual(stem("labiales"), "labial")
+        self.assertEqual(stem("perfumes"), "perfume")
+        self.assertEqual(stem("edp"), "edp")
+        self.assertEqual(stem("100ml"), "100ml")
+
+    def test_bigrama_por_stem(self):
+        db = db_temporal(self)
+        db.productos = [
+            {'id': 1, 'title': "Labial Rojo", 'price': 5000, 'search_text': "labial rojo mate"},
+            {'id': 2, 'title': "Brillo Rojo", 'price': 5000, 'search_text': "brillo rojo"},
+        ]
+        res = db.buscar_contextual("brillos rojos")
+        self.assertEqual([p['id'] for p in res['items']], [2, 1])
+
+class TestTypos(unittest.TestCase):
+    def test_distancia_con_transposicion(self):
+        self.assertEqual(distancia_edicion("shampo", "shampoo", 2), 1)
+        self.assertEqual(distancia_edicion("alhmabra", "alhambra", 2), 1)
+        self.assertEqual(distancia_edicion("perfume", "labial", 2), 3) # Excede el tope
+
+    def test_correccion_contra_vocabulario(self):
+        indice = TrigramIndex(["lattafa", "alhambra", "maison", "shampoo", "30ml"])
+        self.assertEqual(indice.corregir("lataffa"), "lattafa")
+        self.assertEqual(indice.corregir("alambra"), "alhambra")
+        self.assertIsNone(indice.corregir("pan"))       # Muy corta: no se corrige
+        self.assertIsNone(indice.corregir("zapatilla")) # Nada cercano
+
+    def test_busqueda_con_marca_mal_escrita(self):
+        db = db_temporal(self)
+        db.productos = [
+            {'id': 1, 'title': "Lattafa Mayar", 'vendor': "Lattafa", 'price': 12000, 'search_text': "lattafa mayar lattafa"},
+            {'id': 2, 'title': "Maison Alhambra Salvo", 'vendor': "Maison Alhambra", 'price': 15000, 'search_text': "maison alhambra salvo maison alhambra"},
+        ]
+        self.assertEqual([p['id'] for p in db.buscar_contextual("tienen lataffa?")['items']], [1])
+        self.assertEqual([p['id'] for p in db.buscar_contextual("algo de alambra")['items']], [2])
+
+    def test_intencion_como_prefijo_no_bloquea_correccion(self):
+        # "ya" y "ok" son intenciones de cierre: calzan al inicio de "yaraz"/"okarina" pero no son marca
+        db = db_temporal(self)
+        db.productos = [
+            {'id': 1, 'title': "Lattafa Yarax", 'vendor': "Lattafa", 'price': 20000, 'search_text': "lattafa yarax lattafa"},
+            {'id': 2, 'title': "Armaf Okarine", 'vendor': "Armaf", 'price': 18000, 'search_text': "armaf okarine armaf"},
+        ]
+        self.assertEqual([p['id'] for p in db.buscar_contextual("yaraz")['items']], [1])
+        self.assertEqual([p['id'] for p in db.buscar_contextual("okarina")['items']], [2])
+
+@unittest.skipUnless(vector_scorer.disponible(), "NumPy no instalado")
+class TestScorerVectorial(unittest.TestCase):
+    def setUp(self):
+        self.db = db_temporal(self)
+        self.db.productos = [
+            {'id': 1, 'title': "Salvo Elixir", 'price': 15000, 'search_text': "salvo elixir edp 100ml"},
+            {'id': 2, 'title': "Salvo Intense", 'price': 25000, 'search_text': "salvo intense edp"},
+            {'id': 3, 'title': "Labial Rojo", 'price': 5000, 'search_text': "labial rojo mate"},
+            {'id': 4, 'title': "Brillo Rojo", 'price': 6000, 'search_text': "brillo rojo"},
+            {'id': 5, 'title': "Elixir Capilar", 'price': "sin precio", 'search_text': "elixir argan"},
+        ]
+
+    def _ids(self, scorer, consulta):
+        self.db.search_scorer = scorer
+        return [p['id'] for p in self.db._resolver_busqueda(self.db._indice, consulta, extraer_rango_precio(consulta))['items']]
+
+    def test_mismo_ranking_que_python(self):
+        for consulta in ["salvo elixir", "elixir", "rojos", "brillos rojos", "edp hasta 20 mil", "salvo 25000", "argan"]:
+            self.assertEqual(self._ids("numpy", consulta), self._ids("python", consulta), consulta)
+
+    def test_bigrama_y_precio(self):
+        self.assertEqual(self._ids("numpy", "salvo elixir"), [1, 2, 5])
+        self.assertEqual(self._ids("numpy", "edp hasta 20 mil"), [1, 3, 4]) # En rango suman +5 aunque no digan "edp"
+
+    def test_bigrama_dentro_de_tokens_y_por_stem(self):
+        # La frase puede caer dentro de tokens ("xsalvo elixirz") y el bigrama de stems cruza plurales
+        self.db.productos = self.db.productos + [
+            {'id': 6, 'title': "Duo", 'price': 9000, 'search_text': "xsalvo elixirz"},
+            {'id': 7, 'title': "Set Labiales", 'price': 9000, 'search_text': "set  labiales rojos"},
+        ]
+        for consulta in ["salvo elixir", "labial rojo", "labiales rojos", "set labiales"]:
+            self.assertEqual(self._ids("numpy", consulta), self._ids("python", consulta), consulta)
+        self.assertEqual(self._ids("numpy", "salvo elixir")[:2], [1, 6])
+
+def nodo_shopify(p_id, titulo, updated_at, stock=5, status="ACTIVE"):
+    """Nodo `Product` mínimo como lo devuelve la Admin GraphQL API."""
+    return {"node": {
+        "id": f"gid://shopify/Product/{p_id}", "title": titulo, "vendor": "", "productType": "", "tags": [],
+        "status": status, "updatedAt": updated_at, "category": None, "collections": {"edges": []},
+        "images": {"edges": []},
+        "variants": {"edges": [{"node": {
+            "id": f"gid://shopify/ProductVariant/{p_id}0", "price": "10000.0", "compareAtPrice": None,
+            "inventoryQuantity": stock, "inventoryPolicy": "deny"
+        }}]}
+    }}
+
+def respuesta_shopify(edges):
+    r = MagicMock(status_code=200)
+    r.json.return_value = {"data": {"products": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "edges": edges}}}
+    return r
+
+class TestSyncIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = GlamStoreDB(os.path.join(self.tmpdir.name, "test.db"))
+        self.db.shopify_token, self.db.shopify_url = "shpat_test", "tienda.myshopify.com"
+        self.db.modo_vacaciones = False
+        self.db.sync_bulk = False
+        self.esperas = []
+        self.db._throttle.dormir = self.esperas.append # Sin sleeps reales en reintentos
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _sync(self, edges, **kwargs):
+        with patch("database.http_client.post", return_value=respuesta_shopify(edges)) as post:
+            self.db._actualizar_tabla_maestra(**kwargs)
+        return post.call_args.kwargs["json"]["query"]
+
+    def test_primera_sync_completa_y_luego_incremental(self):
+        q1 = self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z"), nodo_shopify(2, "Mayar", "2024-05-01T11:00:00Z")])
+        self.assertIn("status:active", q1)
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-01T11:00:00Z")
+
+        # Incremental: solo lo cambiado (con solape de 60s); el archivado se borra localmente
+        q2 = self._sync([nodo_shopify(2, "Mayar", "2024-05-02T09:00:00Z", status="ARCHIVED"),
+                         nodo_shopify(3, "Yara", "2024-05-02T09:30:00Z")])
+        self.assertIn("updated_at:>'2024-05-01T10:59:00Z'", q2)
+        self.assertNotIn("status:active", q2)
+        self.assertEqual(sorted(p['id'] for p in self.db.productos), [1, 3])
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-02T09:30:00Z")
+
+    def test_reconciliacion_completa_borra_eliminados(self):
+        self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z"), nodo_shopify(2, "Mayar", "2024-05-01T11:00:00Z")])
+        self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")], completa=True)
+        self.assertEqual([p['id'] for p in self.db.productos], [1])
+
+    def test_limpieza_sobre_limite_de_variables_sqlite(self):
+        # Más IDs válidos que SQLITE_MAX_VARIABLE_NUMBER (32766): el NOT IN con placeholders fallaba
+        self._sync([nodo_shopify(i, f"P{i}", "2024-05-01T10:00:00Z") for i in range(1, 33001)] +
+                   [nodo_shopify(99999, "Viejo", "2024-05-01T10:00:00Z")])
+        self._sync([nodo_shopify(i, f"P{i}", "2024-05-01T10:00:00Z") for i in range(1, 33001)], completa=True)
+        self.assertEqual(self.db.sync_status, "OK")
+        self.assertEqual(len(self.db.productos), 33000)
+        self.assertNotIn(99999, self.db._indice.por_id)
+
+    def test_pagina_fallida_guarda_lo_recibido_sin_borrar(self):
+        self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")])
+        pagina1 = respuesta_shopify([nodo_shopify(2, "Mayar", "2024-05-03T10:00:00Z")])
+        pagina1.json.return_value["data"]["products"]["pageInfo"] = {"hasNextPage": True, "endCursor": "c1"}
+        caida = MagicMock(status_code=502, text="bad gateway", headers={}) # Persiste tras todos los reintentos
+        with patch("database.http_client.post", side_effect=[pagina1] + [caida] * 6):
+            self.db._actualizar_tabla_maestra(completa=True)
+        self.assertEqual(sorted(p['id'] for p in self.db.productos), [1, 2])
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-01T10:00:00Z")
+
+    def test_sync_vacia_no_falla(self):
+        self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")])
+        self._sync([])
+        self.assertEqual(self.db.sync_status, "OK")
+        self.assertEqual([p['id'] for p in self.db.productos], [1])
+
+    def test_hash_de_contenido_estable_entre_procesos(self):
+        # El orden de un set depende de PYTHONHASHSEED: el hash no puede depender de él
+        script = (
+            "import os, sys, logging; logging.disable(logging.CRITICAL)\n"
+            "from database import GlamStoreDB\n"
+            "db = GlamStoreDB(os.path.join(sys.argv[1], 'hash.db'))\n"
+            "nodo = {'id': 'gid://shopify/Product/1', 'title': 'Yara', 'vendor': 'Lattafa', 'productType': 'Perfume',\n"
+            "        'tags': ['Mujer', 'Arabe', 'Dulce', 'Vainilla', 'EDP'],\n"
+            "        'collections': {'edges': [{'node': {'title': t}} for t in ['Ofertas', 'Árabes', 'Mujer']]},\n"
+            "        'images': {'edges': []}, 'variants': {'edges': [{'node': {'id': 'gid://shopify/ProductVariant/10',\n"
+            "        'price': '24990', 'compareAtPrice': None, 'inventoryQuantity': 3, 'inventoryPolicy': 'DENY'}}]}}\n"
+            "print(db._nodo_a_fila(nodo, False)[-1])\n"
+        )
+        hashes = set()
+        for seed in ("1", "2", "3", "4"):
+            salida = subprocess.run(
+                [sys.executable, "-c", script, self.tmpdir.name], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "PYTHONHASHSEED": seed}
+            )
+            hashes.add(salida.stdout.strip().splitlines()[-1])
+        self.assertEqual(len(hashes), 1)
+
+    def test_hash_de_contenido_salta_filas_sin_cambios(self):
+        nodos = [nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z"), nodo_shopify(2, "Mayar", "2024-05-01T11:00:00Z")]
+        self._sync(nodos, completa=True)
+        self.assertEqual(self.db.sync_conteos, {"insertados": 2, "actualizados": 0, "sin_cambios": 0, "eliminados": 0})
+        version = self.db._indice.version
+
+        self._sync(nodos, completa=True)
+        self.assertEqual(self.db.sync_conteos, {"insertados": 0, "actualizados": 0, "sin_cambios": 2, "eliminados": 0})
+        self.assertEqual(self.db._indice.version, version) # Nada cambió: no se recarga la memoria
+
+        self._sync([nodo_shopify(1, "Salvo Elixir", "2024-05-03T10:00:00Z"), nodo_shopify(3, "Yara", "2024-05-03T10:00:00Z")], completa=True)
+        self.assertEqual(self.db.sync_conteos, {"insertados": 1, "actualizados": 1, "sin_cambios": 0, "eliminados": 1})
+        self.assertEqual(self.db._indice.por_id[1]['title'], "Salvo Elixir")
+
+    def test_recarga_parcial_parcha_solo_lo_cambiado(self):
+        nodos = [nodo_shopify(i, f"Perfume {i}", "2024-05-01T10:00:00Z") for i in range(1, 21)]
+        self._sync(nodos, completa=True)
+        antes = self.db._indice.por_id
+
+        # Cambia 1, entra 1 y se archiva 1 (incremental)
+        self._sync([nodo_shopify(5, "Perfume Salvo", "2024-05-02T10:00:00Z"),
+                    nodo_shopify(21, "Perfume Yara", "2024-05-02T10:00:00Z"),
+                    nodo_shopify(7, "Perfume 7", "2024-05-02T10:00:00Z", status="ARCHIVED")])
+        indice = self.db._indice
+        self.assertEqual(sorted(indice.por_id), [i for i in range(1, 22) if i != 7])
+        self.assertIs(indice.por_id[1], antes[1])  # Sin cambios: mismo objeto (no se releyó)
+        self.assertIsNot(indice.por_id[5], antes[5])
+        self.assertEqual(indice.ids_con_substring("salvo"), {5})
+        self.assertEqual([p['id'] for p in self.db.buscar_contextual("yara")['items']], [21])
+
+        # Otro worker (otra instancia) recarga parcial vía get_productos_frescos
+        otro = GlamStoreDB(self.db.db_path)
+        self._sync([nodo_shopify(5, "Perfume Salvo Elixir", "2024-05-03T10:00:00Z")])
+        otro.get_productos_frescos()
+        self.assertEqual(otro._indice.por_id[5]['title'], "Perfume Salvo Elixir")
+        self.assertEqual(len(otro.productos), 20)
+
+    def test_recargas_concurrentes_aplican_el_delta_una_vez(self):
+        self._sync([nodo_shopify(i, f"Perfume {i}", "2024-05-01T10:00:00Z") for i in range(1, 4)])
+        otro = GlamStoreDB(self.db.db_path)
+        self._sync([nodo_shopify(2, "Perfume Salvo", "2024-05-02T10:00:00Z")])
+
+        original = otro._indice.aplicar_delta
+        def lento(*args, **kwargs):
+            time.sleep(0.05) # Ventana para que las demás recargas lean la misma generación
+            return original(*args, **kwargs)
+        with patch.object(type(otro._indice), "aplicar_delta", side_effect=lento, autospec=False) as delta:
+            hilos = [threading.Thread(target=otro._recargar_memoria) for _ in range(4)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+        self.assertEqual(delta.call_count, 1) # Las demás ven la generación ya cargada y no hacen nada
+        self.assertEqual(otro._generacion_cargada, self.db._generacion_cargada)
+        self.assertEqual(otro._indice.por_id[2]['title'], "Perfume Salvo")
+
+    def test_fts_se_mantiene_por_fila_en_el_merge(self):
+        if not self.db.fts_disponible:
+            self.skipTest("SQLite sin FTS5")
+        def fts(termino):
+            conn = self.db._get_conn()
+            ids = sorted(r[0] for r in conn.execute("SELECT rowid FROM productos_fts WHERE productos_fts MATCH ?", (termino,)))
+            conn.close()
+            return ids
+
+        self._sync([nodo_shopify(i, f"Perfume {i}", "2024-05-01T10:00:00Z") for i in range(1, 4)])
+        self.assertEqual(fts("perfume"), [1, 2, 3])
+        sentencias = []
+        conectar = self.db._get_conn
+        def con_traza():
+            conn = conectar()
+            conn.set_trace_callback(sentencias.append)
+            return conn
+        with patch.object(self.db, "_get_conn", side_effect=con_traza):
+            self._sync([nodo_shopify(2, "Salvo Elixir", "2024-05-02T10:00:00Z"),
+                        nodo_shopify(3, "Perfume 3", "2024-05-02T10:00:00Z", status="ARCHIVED")])
+        self.assertFalse([q for q in sentencias if "'rebuild'" in q]) # Sin reconstruir todo el índice
+        self.assertEqual(fts("perfume"), [1])
+        self.assertEqual(fts("salvo"), [2])
+
+    def test_error_no_avanza_cursor(self):
+        self._sync([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")])
+        with patch("database.http_client.post", return_value=MagicMock(status_code=500, text="boom")):
+            self.db._actualizar_tabla_maestra()
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-01T10:00:00Z")
+        self.assertEqual([p['id'] for p in self.db.productos], [1])
+
+    def test_refresco_puntual_solo_de_lo_comprado(self):
+        self._sync([nodo_shopify(i, f"Perfume {i}", "2024-05-01T10:00:00Z") for i in range(1, 4)])
+        generacion = self.db._generacion_cargada
+        antes = self.db._indice.por_id
+
+        r = MagicMock(status_code=200)
+        r.json.return_value = {"data": {"nodes": [
+            nodo_shopify(2, "Perfume 2", "2024-05-02T10:00:00Z", stock=4)["node"],
+            nodo_shopify(3, "Perfume 3", "2024-05-02T10:00:00Z", stock=0)["node"], # Se vendió el último
+            None, # Ya no existe en Shopify
+        ]}}
+        with patch("database.http_client.post", return_value=r) as post:
+            conteos = self.db.refrescar_productos([3, 2, 99])
+        self.assertEqual(post.call_count, 1)
+        self.assertIn("nodes(ids: $ids)", post.call_args.kwargs["json"]["query"])
+        self.assertEqual(post.call_args.kwargs["json"]["variables"]["ids"],
+                         ["gid://shopify/Product/2", "gid://shopify/Product/3", "gid://shopify/Product/99"])
+        self.assertEqual(conteos, {"actualizados": 1, "eliminados": 1, "sin_cambios": 0})
+
+        indice = self.db._indice
+        self.assertEqual(sorted(indice.por_id), [1, 2])
+        self.assertEqual(indice.por_id[2]['stock'], 4)
+        self.assertIs(indice.por_id[1], antes[1]) # Recarga delta: lo demás no se relee
+        self.assertEqual(self.db._generacion_cargada, generacion + 1)
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-01T10:00:00Z") # Cursor intacto
+
+    def test_draft_order_refresca_solo_sus_productos(self):
+        refrescados = threading.Event()
+        r = MagicMock(status_code=201)
+        r.json.return_value = {"draft_order": {"invoice_url": "https://tienda/invoice"}}
+        items = [{"id": 7, "variant_id": 70, "price": 1000.0}]
+        with patch("database.http_client.post", return_value=r), \
+             patch.object(self.db, "force_sync") as force_sync, \
+             patch.object(self.db, "refrescar_productos", side_effect=lambda ids: refrescados.set()) as refresco:
+            self.assertEqual(self.db._crear_draft_order(items)["url"], "https://tienda/invoice")
+            self.assertTrue(refrescados.wait(2))
+        refresco.assert_called_once_with([7])
+        force_sync.assert_not_called()
+
+    def test_throttled_y_5xx_se_reintentan_sin_abortar(self):
+        costo = {"requestedQueryCost": 502, "actualQueryCost": 400,
+                 "throttleStatus": {"maximumAvailable": 2000.0, "currentlyAvailable": 100, "restoreRate": 100.0}}
+        throttled = MagicMock(status_code=200)
+        throttled.json.return_value = {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                                       "extensions": {"cost": costo}}
+        caido = MagicMock(status_code=502, text="Bad Gateway", headers={})
+        ok = respuesta_shopify([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")])
+        with patch("database.http_client.post", side_effect=[throttled, caido, ok]) as post:
+            self.db._actualizar_tabla_maestra(completa=True)
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual([p['id'] for p in self.db.productos], [1])
+        self.assertEqual(self.db.sync_status, "OK")
+        # Página siguiente dimensionada por costo: 502/50 por producto -> caben 99 en 1000 puntos
+        self.assertIn("first: 99", post.call_args.kwargs["json"]["query"])
+        self.assertGreater(self.esperas[0], 0) # Espera por puntos tras el THROTTLED
+        self.assertEqual(self.esperas[1], 2.0) # Backoff del 502 (segundo intento)
+
+    def test_sondeo_recarga_solo_si_cambio_el_catalogo(self):
+        self._sync([nodo_shopify(i, f"Perfume {i}", "2024-05-01T10:00:00Z") for i in range(1, 4)])
+        otro = GlamStoreDB(self.db.db_path)
+        otro.catalogo_sondeo_segundos = 0
+
+        # Escrituras que no tocan el catálogo (config) no disparan recarga
+        with patch.object(otro, "_recargar_memoria") as recarga:
+            otro.get_productos_frescos()
+            self.db._set_config("modo_vacaciones", "false")
+            otro.get_productos_frescos()
+        recarga.assert_not_called()
+
+        self._sync([nodo_shopify(4, "Perfume 4", "2024-05-02T10:00:00Z")])
+        self.assertEqual(len(otro.get_productos_frescos()), 4)
+
+        # Dentro del intervalo no se sondea: se sirve lo que hay en memoria
+        otro.catalogo_sondeo_segundos = 3600
+        self._sync([nodo_shopify(5, "Perfume 5", "2024-05-03T10:00:00Z")])
+        self.assertEqual(len(otro.get_productos_frescos()), 4)
+
+class TestSyncBulk(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = GlamStoreDB(os.path.join(self.tmpdir.name, "test.db"))
+        self.db.modo_vacaciones = False
+        self.db.sync_bulk_polling = 0.01
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_armar_productos_desde_jsonl(self):
+        lineas = [
+            {"id": "gid://shopify/Product/1", "title": "A"},
+            {"id": "gid://shopify/ProductVariant/10", "price": "1000", "__parentId": "gid://shopify/Product/1"},
+            {"id": "gid://shopify/ProductVariant/11", "price": "2000", "__parentId": "gid://shopify/Product/1"},
+            {"id": "gid://shopify/ProductImage/5", "url": "https://x/a.jpg", "__parentId": "gid://shopify/Product/1"},
+            {"id": "gid://shopify/Product/2", "title": "B"},
+            {"id": "gid://shopify/Collection/7", "title": "Ofertas", "__parentId": "gid://shopify/Product/1"}, # Fuera de orden
+        ]
+        productos = list(armar_productos(iter(lineas)))
+        self.assertEqual([p["title"] for p in productos], ["A", "B"])
+        self.assertEqual([e["node"]["price"] for e in productos[0]["variants"]["edges"]], ["1000"]) # Solo la primera
+        self.assertEqual(productos[0]["images"]["edges"][0]["node"]["url"], "https://x/a.jpg")
+        self.assertEqual(productos[1]["collections"]["edges"], [])
+
+    def test_sync_completa_bulk_contra_stub(self):
+        with ShopifyBulkStub(polls_en_curso=2) as stub:
+            self.db.shopify_token, self.db.shopify_url = "shpat_test", stub.base_url
+            self.db._actualizar_tabla_maestra(completa=True)
+
+        self.assertIn("status:active", stub.queries[0])
+        por_id = {p['id']: p for p in self.db.productos}
+        self.assertEqual(sorted(por_id), [1001, 1002])
+        salvo = por_id[1001]
+        self.assertEqual((salvo['price'], salvo['compare_at_price'], salvo['variant_id']), (29990.0, 34990.0, 2001))
+        self.assertIn("Árabes", salvo['tags'])
+        self.assertEqual(salvo['images'], ["https://cdn.example.com/salvo.jpg"])
+        self.assertEqual(self.db._get_config("sync_cursor_updated_at", ""), "2024-05-02T12:30:00Z")
+
+    def test_operacion_fallida_retorna_none(self):
+        with ShopifyBulkStub(estado_final="FAILED") as stub:
+            importador = ShopifyBulkImporter(stub.graphql_url, {}, intervalo_polling=0.01)
+            self.assertIsNone(importador.ejecutar("{ products { edges { node { id } } } }"))
+
+    def test_error_de_red_en_bulk_cae_a_paginado(self):
+        self.db.shopify_token, self.db.shopify_url = "shpat_test", "tienda.myshopify.com"
+        queries = []
+
+        def post(url, json=None, **kwargs):
+            queries.append(json["query"])
+            if "bulkOperationRunQuery" in json["query"]:
+                raise requests.ConnectionError("connection reset")
+            return respuesta_shopify([nodo_shopify(1, "Salvo", "2024-05-01T10:00:00Z")])
+
+        with patch("database.http_client.post", side_effect=post):
+            self.db._actualizar_tabla_maestra(completa=True)
+        self.assertEqual(self.db.sync_status, "OK")
+        self.assertEqual(len(queries), 2) # Bulk falló -> una página paginada
+        self.assertIn("products(first:", queries[1])
+        self.assertEqual([p['id'] for p in self.db.productos], [1])
+
+class TestPrefetch(unittest.TestCase):
+    def test_orden_y_solapamiento(self):
+        pidiendo_segunda = threading.Event()
+
+        def paginas():
+            yield 1
+            pidiendo_segunda.set() # El productor ya va por la siguiente página
+            yield 2
+
+        vistos = []
+        for pagina in prefetch(paginas(), max_pendientes=1):
+            if pagina == 1:
+                # Mientras se "escribe" la página 1, la 2 ya se está trayendo
+                self.assertTrue(pidiendo_segunda.wait(2))
+            vistos.append(pagina)
+        self.assertEqual(vistos, [1, 2])
+
+    def test_error_del_productor_llega_al_consumidor(self):
+        def paginas():
+            yield 1
+            raise ValueError("HTTP 502")
+
+        vistos = []
+        with self.assertRaises(ValueError):
+            for pagina in prefetch(paginas()):
+                vistos.append(pagina)
+        self.assertEqual(vistos, [1])
+
+    def test_consumidor_corta_y_productor_se_detiene(self):
+        producidas = []
+
+        def paginas():
+            for i in range(100):
+                producidas.append(i)
+                yield i
+
+        it = prefetch(paginas(), max_pendientes=1)
+        self.assertEqual(next(it), 0)
+        it.close()
+        time.sleep(0.3)
+        self.assertLess(len(producidas), 5) # Cola acotada: no recorre todo
+
+class TestShopifyThrottle(unittest.TestCase):
+    def setUp(self):
+        self.ahora = 0.0
+        self.esperas = []
+        self.throttle = ShopifyThrottle(dormir=self.esperas.append, reloj=lambda: self.ahora)
+
+    def _respuesta(self, solicitado, disponible, maximo=2000.0, recuperacion=100.0):
+        return {"data": {}, "extensions": {"cost": {"requestedQueryCost": solicitado, "throttleStatus": {
+            "maximumAvailable": maximo, "currentlyAvailable": disponible, "restoreRate": recuperacion}}}}
+
+    def test_pagina_inicial_y_luego_la_mayor_que_cabe(self):
+        self.assertEqual(self.throttle.tamano_pagina(), 50)
+        self.throttle.registrar(self._respuesta(solicitado=200, disponible=1800), first=50) # 4 puntos por producto
+        self.assertEqual(self.throttle.tamano_pagina(), 250) # 1000 // 4 = 250 (tope de Shopify)
+        self.throttle.registrar(self._respuesta(solicitado=1600, disponible=1800), first=100) # 16 por producto
+        self.assertEqual(self.throttle.tamano_pagina(), 62)
+
+    def test_espera_solo_lo_que_falta_recuperar(self):
+        self.throttle.registrar(self._respuesta(solicitado=500, disponible=100), first=50) # 10 por producto
+        self.assertEqual(self.throttle.antes_de_consultar(50), 4.0) # Faltan 400 puntos a 100/s
+        self.ahora = 10.0 # Pasó el tiempo: el bucket ya se recuperó
+        self.assertEqual(self.throttle.antes_de_consultar(50), 0.0)
+        self.assertEqual(self.esperas, [4.0])
+
+    def test_detecta_throttled(self):
+        data = self._respuesta(solicitado=500, disponible=10)
+        self.assertFalse(self.throttle.registrar(data, first=50))
+        data["errors"] = [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}]
+        self.assertTrue(self.throttle.registrar(data, first=50))
+
+class TestHttpClient(unittest.TestCase):
+    def test_reutiliza_conexion_por_host(self):
+        cliente = HttpClient(timeout=5)
+        with ShopifyBulkStub() as stub:
+            for _ in range(3):
+                r = cliente.post(stub.graphql_url, json={"query": "{ currentBulkOperation { id } }"})
+                self.assertEqual(r.status_code, 200)
+            host = stub.base_url.replace("http://", "")
+            self.assertIs(cliente.sesion(stub.graphql_url), cliente.sesion(f"{stub.base_url}/bulk.jsonl"))
+            self.assertEqual(cliente.stats()[host], {"requests": 3, "conexiones": 1, "reutilizadas": 2})
+        cliente.cerrar()
+
+    def test_sesion_distinta_por_host_y_timeout_por_defecto(self):
+        cliente = HttpClient(timeout=(1, 2))
+        self.assertIsNot(cliente.sesion("https://tienda.myshopify.com/x"), cliente.sesion("https://graph.facebook.com/y"))
+        with patch("requests.Session.request") as request:
+            cliente.get("https://graph.facebook.com/v18.0/123")
+            cliente.get("https://graph.facebook.com/v18.0/123", timeout=60)
+        self.assertEqual(request.call_args_list[0].kwargs["timeout"], (1, 2))
+        self.assertEqual(request.call_args_list[1].kwargs["timeout"], 60)
+
+class TestWorkerPool(unittest.TestCase):
+    def test_cola_llena_rechaza_sin_bloquear(self):
+        pool = BoundedWorkerPool(workers=1, max_cola=2, nombre="test")
+        liberar, empezo = threading.Event(), threading.Event()
+        hechas = []
+
+        def tarea(i):
+            empezo.set()
+            liberar.wait(2)
+            hechas.append(i)
+
+        self.assertTrue(pool.enviar(tarea, 0))
+        self.assertTrue(empezo.wait(2)) # El único worker está ocupado
+        self.assertTrue(pool.enviar(tarea, 1))
+        self.assertTrue(pool.enviar(tarea, 2))
+        self.assertFalse(pool.enviar(tarea, 3)) # Cola llena: backpressure
+        stats = pool.stats()
+        self.assertEqual((stats["en_cola"], stats["en_proceso"], stats["rechazadas"]), (2, 1, 1))
+
+        liberar.set()
+        pool.detener(timeout=2)
+        self.assertEqual(hechas, [0, 1, 2])
+        stats = pool.stats()
+        self.assertEqual((stats["procesadas"], stats["en_cola"]), (3, 0))
+        self.assertGreater(stats["espera_max_ms"], 0)
+
+    def test_error_en_tarea_no_mata_al_worker(self):
+        pool = BoundedWorkerPool(workers=1, max_cola=4)
+        hechas = []
+        pool.enviar(lambda: 1 / 0)
+        pool.enviar(hechas.append, "ok")
+        pool.detener(timeout=2)
+        self.assertEqual(hechas, ["ok"])
+        self.assertEqual(pool.stats()["fallidas"], 1)
+
+    def test_limitador_un_aviso_por_clave_por_ventana(self):
+        ahora = [0.0]
+        limite = LimitadorPorClave(ventana=60, max_claves=2, reloj=lambda: ahora[0])
+        self.assertTrue(limite.permitir("569A"))
+        self.assertFalse(limite.permitir("569A")) # Mismo número dentro de la ventana
+        self.assertTrue(limite.permitir("569B"))
+        ahora[0] = 61
+        self.assertTrue(limite.permitir("569A")) # Venció la ventana
+        self.assertTrue(limite.permitir("569C")) # Purga de claves vencidas: memoria acotada
+        self.assertLessEqual(len(limite._ultimo), 2)
+        self.assertEqual(limite.suprimidos, 1)
+
+class TestDespachadorPorCliente(unittest.TestCase):
+    def test_orden_por_cliente_y_paralelo_entre_clientes(self):
+        pool = BoundedWorkerPool(workers=2, max_cola=8)
+        activos, solapes, vistos = {}, [], []
+        lock = threading.Lock()
+
+        def procesar(numero, texto):
+            with lock:
+                if activos.get(numero):
+                    solapes.append(numero) # Dos mensajes del mismo cliente a la vez
+                activos[numero] = True
+                otros = [n for n, a in activos.items() if a and n != numero]
+            time.sleep(0.05)
+            with lock:
+                activos[numero] = False
+                vistos.append((numero, texto, bool(otros)))
+
+        despachador = KeyedDispatcher(pool, procesar)
+        for i in range(3):
+            self.assertTrue(despachador.enviar("569A", f"a{i}"))
+            self.assertTrue(despachador.enviar("569B", f"b{i}"))
+        pool.detener(timeout=2)
+
+        self.assertEqual(solapes, [])
+        self.assertEqual([t for n, t, _ in vistos if n == "569A"], ["a0", "a1", "a2"])
+        self.assertEqual([t for n, t, _ in vistos if n == "569B"], ["b0", "b1", "b2"])
+        self.assertTrue(any(paralelo for _, _, paralelo in vistos)) # A y B sí corren juntos
+        self.assertEqual(despachador.stats()["carriles_activos"], 0)
+
+    def test_rafaga_se_combina_en_una_llamada(self):
+        pool = BoundedWorkerPool(workers=1, max_cola=4)
+        llamadas = []
+        despachador = KeyedDispatcher(pool, lambda numero, texto: llamadas.append(texto),
+                                      combinar=lambda lote: [" ".join(lote)], ventana=0.1)
+        for texto in ["hola", "busco", "labial rojo"]:
+            despachador.enviar("569A", texto)
+        pool.detener(timeout=2)
+        self.assertEqual(llamadas, ["hola busco labial rojo"])
+        self.assertEqual(despachador.stats()["combinados"], 2)
+
+    def test_pool_lleno_no_deja_carril_huerfano(self):
+        pool = BoundedWorkerPool(workers=1, max_cola=1)
+        liberar, empezo = threading.Event(), threading.Event()
+        procesados = []
+
+        def procesar(numero, texto):
+            empezo.set()
+            liberar.wait(2)
+            procesados.append(texto)
+
+        despachador = KeyedDispatcher(pool, procesar)
+        self.assertTrue(despachador.enviar("569A", "a"))
+        self.assertTrue(empezo.wait(2))
+        self.assertTrue(despachador.enviar("569B", "b")) # Ocupa el único lugar de la cola
+        self.assertFalse(despachador.enviar("569C", "c1")) # Pool lleno
+        self.assertFalse(despachador.enviar("569C", "c2")) # Sin carril fantasma que lo acepte
+        self.assertEqual(despachador.stats()["carriles_activos"], 2)
+        liberar.set()
+        pool.detener(timeout=2)
+        self.assertEqual(procesados, ["a", "b"])
+        self.assertEqual(despachador.stats()["rechazados_carril"], 2)
+
+    def test_carril_lleno_rechaza(self):
+        pool = BoundedWorkerPool(workers=1, max_cola=4)
+        liberar = threading.Event()
+        despachador = KeyedDispatcher(pool, lambda numero, texto: liberar.wait(2), max_por_carril=1)
+        self.assertTrue(despachador.enviar("569A", "1"))
+        time.sleep(0.05) # El drenado ya tomó el primero
+        self.assertTrue(despachador.enviar("569A", "2"))
+        self.assertFalse(despachador.enviar("569A", "3"))
+        liberar.set()
+        pool.detener(timeout=2)
+        self.assertEqual(despachador.stats()["rechazados_carril"], 1)
+
+class TestDeduplicacionLote(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = GlamStoreDB(os.path.join(self.tmpdir.name, "test.db"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lote_marca_nuevos_y_detecta_duplicados(self):
+        self.assertFalse(self.db.check_message_id("wamid.1"))
+        duplicados = self.db.check_message_ids(["wamid.1", "wamid.2", "wamid.3", "wamid.2", None])
+        self.assertEqual(duplicados, {"wamid.1"}) # Solo lo ya procesado antes del lote
+        self.assertEqual(self.db.check_message_ids(["wamid.2", "wamid.3", "wamid.4"]), {"wamid.2", "wamid.3"})
+        self.assertTrue(self.db.check_message_id("wamid.4"))
+        self.assertEqual(self.db.check_message_ids([]), set())
+
+    def test_no_aceptado_se_libera_para_el_reenvio(self):
+        self.assertEqual(self.db.check_message_ids(["wamid.1", "wamid.2"]), set())
+        self.db.liberar_message_ids(["wamid.2", None]) # Ej: rechazado por rate limit
+        self.assertEqual(self.db.check_message_ids(["wamid.1", "wamid.2"]), {"wamid.1"})
+
+class TestSyncCoordinada(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = GlamStoreDB(os.path.join(self.tmpdir.name, "test.db"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _coordinador(self) -> SyncCoordinator:
+        return SyncCoordinator(self.db._get_conn, ttl_segundos=30, intervalo_espera=0.05)
+
+    def test_pedidos_concurrentes_esperan_la_misma_sync(self):
+        coord = self._coordinador()
+        liberar = threading.Event()
+        corridas = []
+
+        def tarea():
+            corridas.append(1)
+            liberar.wait(2)
+            return "ok"
+
+        futuros = [coord.solicitar(tarea) for _ in range(5)]
+        liberar.set()
+        self.assertEqual({f.result(2) for f in futuros}, {"ok"})
+        self.assertEqual(len(corridas), 1)
+        self.assertEqual(len({id(f) for f in futuros}), 1)
+        # Terminada la anterior, un pedido nuevo sí lanza otra
+        self.assertEqual(coord.solicitar(tarea).result(2), "ok")
+        self.assertEqual(len(corridas), 2)
+
+    def test_otro_worker_espera_el_lease_y_no_sincroniza(self):
+        worker_a, worker_b = self._coordinador(), self._coordinador()
+        liberar = threading.Event()
+        corridas, recargas = [], []
+
+        def tarea(nombre):
+            corridas.append(nombre)
+            liberar.wait(2)
+
+        futuro_a = worker_a.solicitar(lambda: tarea("a"))
+        time.sleep(0.1) # A ya tomó el lease
+        futuro_b = worker_b.solicitar(lambda: tarea("b"), al_esperar_remoto=lambda: recargas.append("b"))
+        time.sleep(0.2)
+        self.assertFalse(futuro_b.done()) # B espera mientras A sincroniza
+
+        liberar.set()
+        futuro_a.result(2)
+        futuro_b.result(2)
+        self.assertEqual(corridas, ["a"])
+        self.assertEqual(recargas, ["b"])
+        self.assertEqual(self.db._get_config("lease_sync", ""), "") # Lease liberado
+
+    def test_lease_vencido_de_proceso_muerto_se_retoma(self):
+        self.db._set_config("lease_sync", '{"owner": "otro-host:1:dead", "expira": 0}')
+        coord = self._coordinador()
+        self.assertEqual(coord.solicitar(lambda: "retomada").result(2), "retomada")
+
+    def test_force_sync_pasa_por_el_coordinador(self):
+        liberar = threading.Event()
+        with patch.object(self.db, "_actualizar_tabla_maestra", side_effect=lambda **kw: liberar.wait(2)) as sync:
+            self.db.force_sync()
+            self.db.force_sync(completa=True)
+            self.db.trigger_sync_if_stale()
+            self.assertTrue(self.db.get_status()["sync_en_curso"])
+            futuro = self.db.solicitar_sync() # Se suma a la que ya corre
+            liberar.set()
+            futuro.result(2)
+        self.assertEqual(sync.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main()